@@ -0,0 +1,981 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+`Workflow` with the caching, search and instrumentation the script filters,
+the refresh coordinator and the query server rely on.
+
+The library in `workflow/` is Alfred-PyWorkflow, which `make update-lib`
+replaces with its latest release, so the workflow's own additions to
+`Workflow` live in the subclass `AppWorkflow` here:
+
+- cached data validated by what they were derived from, returned while
+  stale, kept in memory by a long-running process or stored in SQLite
+- filtering prepared search corpora (see `search`)
+- timings and profiles of runs and latencies of the `brew` commands run
+"""
+
+import io
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import strtab  # noqa: F401 (registers the `strtab` serializer)
+from search import narrows, rank
+from workflow import ICON_CLOCK, MATCH_ALL, Workflow
+from workflow.util import atomic_writer
+from workflow.workflow import UNSET, manager
+
+#: Names of the supported cache stores
+CACHE_STORES = ('files', 'sqlite')
+
+#: Filename of the SQLite cache store in the cache directory
+CACHE_DB_NAME = 'cache.sqlite3'
+
+#: Number of cached data kept in :attr:`AppWorkflow.cache_memo`
+CACHE_MEMO_SIZE = 32
+
+#: Filename of the bundle ID, name and version cached from ``info.plist``
+#: in the cache directory
+INFO_CACHE_NAME = '__workflow_info.json'
+
+#: Cache key of the status of update checks, which `workflow/update.py`
+#: saves with the library's standard serializer in a cache file
+UPDATE_STATUS_KEY = '__workflow_latest_version'
+
+#: Filename of the timings of recent runs in the cache directory
+METRICS_NAME = '__workflow_metrics.jsonl'
+
+#: Number of runs whose timings are kept in :data:`METRICS_NAME`
+METRICS_MAX_RUNS = 100
+
+#: Environment variable to save the timings of every run to
+#: :data:`METRICS_NAME`, not only while Alfred's debugger is open
+METRICS_ENV = 'WF_METRICS'
+
+#: Filename of the latency histograms of commands in the data directory
+COMMAND_STATS_NAME = '__workflow_commands.json'
+
+#: Environment variable to profile runs: ``cpu`` (or any other non-empty
+#: value) for :mod:`cProfile` only, ``memory`` for :mod:`tracemalloc` too
+PROFILE_ENV = 'WF_PROFILE'
+
+#: Name of the directory in the cache directory profiles are saved in
+PROFILE_DIR_NAME = '__workflow_profiles'
+
+#: Number of profiled runs whose reports are kept
+PROFILE_MAX_RUNS = 10
+
+#: Number of functions and allocations listed in profile reports
+PROFILE_TOP = 40
+
+
+class AppWorkflow(Workflow):
+    """:class:`~workflow.Workflow` with the workflow's own additions.
+
+    Takes the same arguments as :class:`~workflow.Workflow`.
+
+    """
+
+    # Whether the startup of this process has been added to `spans`
+    _startup_timed = False
+
+    def __init__(self, *args, **kwargs):
+        """Create new :class:`AppWorkflow` object."""
+        super().__init__(*args, **kwargs)
+        self._cache_store = 'files'
+        self._cache_db = None
+        self._command_tracer = None
+        #: Dictionary to keep data loaded by :meth:`cached_data` in, so
+        #: long-running processes can share it between :class:`AppWorkflow`
+        #: instances. Data are re-used as long as their cache file (or row)
+        #: is unchanged, so they must not be modified. Only the
+        #: :data:`CACHE_MEMO_SIZE` most recently used data are kept.
+        #: ``None`` (the default) disables it.
+        self.cache_memo = None
+        #: ``(name, seconds)`` of the phases timed by :meth:`span`,
+        #: in the order they finished.
+        self.spans = []
+        self._items_time = 0.0
+        self._info_metadata = None
+        self.magic_arguments['stats'] = self._show_stats
+
+    # info.plist contents ----------------------------------------------
+
+    @property
+    def info_metadata(self):
+        """Bundle ID, name and version from ``info.plist``.
+
+        Parsing ``info.plist`` takes longer than everything else a
+        script filter usually does before it can filter its items, so
+        these values are cached in the cache directory, together with
+        the modification time of ``info.plist``, and only read from
+        ``info.plist`` again when it has been modified.
+
+        The cache is only used when Alfred provides the path to the
+        cache directory, because without it the path depends on the
+        bundle ID.
+
+        :returns: ``dict`` with the keys ``bundleid``, ``name`` and
+            ``version`` (values are ``None`` if not set)
+        :rtype: ``dict``
+
+        """
+        if self._info_metadata is None:
+            self._info_metadata = self._load_info_metadata()
+
+        return self._info_metadata
+
+    @property
+    def bundleid(self):
+        """Workflow bundle ID from environmental vars or :attr:`info_metadata`."""
+        if not self._bundleid:
+            if self.alfred_env.get('workflow_bundleid'):
+                self._bundleid = self.alfred_env.get('workflow_bundleid')
+            else:
+                self._bundleid = self.info_metadata['bundleid']
+
+        return self._bundleid
+
+    @property
+    def name(self):
+        """Workflow name from Alfred's environmental vars or :attr:`info_metadata`."""
+        if not self._name:
+            if self.alfred_env.get('workflow_name'):
+                self._name = self.decode(self.alfred_env.get('workflow_name'))
+            else:
+                self._name = self.decode(self.info_metadata['name'])
+
+        return self._name
+
+    @property
+    def version(self):
+        """Version of the workflow, see :attr:`Workflow.version`.
+
+        Falls back to :attr:`info_metadata` instead of :attr:`info`.
+
+        """
+        if self._version is UNSET:
+
+            version = None
+            # environment variable has priority
+            if self.alfred_env.get('workflow_version'):
+                version = self.alfred_env['workflow_version']
+
+            # Try `update_settings`
+            elif self._update_settings:
+                version = self._update_settings.get('version')
+
+            # `version` file
+            if not version:
+                filepath = self.workflowfile('version')
+
+                if os.path.exists(filepath):
+                    with open(filepath, 'r') as fileobj:
+                        version = fileobj.read()
+
+            # info.plist
+            if not version:
+                version = self.info_metadata['version']
+
+            if version:
+                from workflow.update import Version
+                version = Version(version)
+
+            self._version = version
+
+        return self._version
+
+    @property
+    def settings(self):
+        """Return a dictionary subclass that saves itself when changed.
+
+        See :attr:`Workflow.settings`. Loading them is timed by :meth:`span`.
+
+        """
+        if not self._settings:
+            with self.span('settings'):
+                return super().settings
+        return self._settings
+
+    # Caching methods --------------------------------------------------
+
+    @property
+    def cache_store(self):
+        """Where cached data are stored.
+
+        Either ``files`` (the default), one file per key in
+        :attr:`cachedir`, or ``sqlite``, a single SQLite database in
+        :attr:`cachedir` (see :class:`~cachedb.CacheDB`).
+        The SQLite store supports writing several keys at once with
+        :meth:`cache_transaction`.
+
+        Data are still serialized with :attr:`cache_serializer`.
+
+        :returns: store name
+        :rtype: ``str``
+
+        """
+        return self._cache_store
+
+    @cache_store.setter
+    def cache_store(self, store_name):
+        """Set where cached data are stored.
+
+        :param store_name: ``files`` or ``sqlite``. Otherwise a
+            :class:`ValueError` will be raised.
+
+        """
+        if store_name not in CACHE_STORES:
+            raise ValueError('Unknown cache store : `{0}`'.format(store_name))
+
+        self.logger.debug('cache store: %s', store_name)
+
+        self._cache_store = store_name
+
+    @property
+    def cache_db(self):
+        """SQLite cache store in :attr:`cachedir`.
+
+        Used if :attr:`cache_store` is ``sqlite``.
+
+        :returns: :class:`~cachedb.CacheDB` instance
+
+        """
+        if self._cache_db is None:
+            from cachedb import CacheDB
+            self._cache_db = CacheDB(self.cachefile(CACHE_DB_NAME))
+
+        return self._cache_db
+
+    @property
+    def command_tracer(self):
+        """Latency histograms of the commands the workflow runs.
+
+        Saved to :data:`COMMAND_STATS_NAME` in the data directory. Run
+        commands with :meth:`CommandTracer.run()
+        <tracer.CommandTracer.run>` to record them. The
+        ``workflow:stats`` :ref:`magic argument <magic-arguments>` shows
+        the median and 95th percentile of every command.
+
+        :returns: :class:`~tracer.CommandTracer` instance
+
+        """
+        if self._command_tracer is None:
+            from tracer import CommandTracer
+            self._command_tracer = CommandTracer(
+                self.datafile(COMMAND_STATS_NAME))
+
+        return self._command_tracer
+
+    @contextmanager
+    def cache_transaction(self):
+        """Context manager to cache several keys at once.
+
+        With the ``sqlite`` :attr:`cache_store`, all data cached in the
+        ``with`` block by the current thread are written in a single
+        transaction, so readers see either all or none of them. With the
+        ``files`` store, data are written one by one as before.
+
+        """
+        if self.cache_store == 'sqlite':
+            with self.cache_db.transaction():
+                yield
+        else:
+            yield
+
+    def cached_data(self, name, data_func=None, max_age=60, session=False,
+                    validator=None):
+        """Cache API with session-scoped expiry.
+
+        Return cached data if younger than ``max_age`` seconds.
+
+        Retrieve data from cache or re-generate and re-cache data if
+        stale/non-existant. If ``max_age`` is 0, return cached data no
+        matter how old.
+
+        If ``validator`` is given and the cached data were saved with a
+        validator (see :meth:`cache_data`), the data are fresh as long as
+        both validators are equal, no matter how old the data are, and
+        ``max_age`` is ignored.
+
+        :param name: Name of datastore
+        :type name: ``str``
+        :param data_func: Callable that returns fresh data. It
+                is called if the cache has expired or doesn't exist.
+        :type data_func: ``callable``
+        :param max_age: Maximum allowable age of cached data in seconds.
+        :type max_age: ``int``
+        :param session: Whether to scope the cache to the current session (optional).
+        :type session: ``bool``
+        :param validator: Current validator of the data (optional).
+                It must be computed *before* ``data_func`` is called.
+        :returns: Cached data, return value of ``data_func`` or ``None``
+            if ``data_func`` is not set.
+
+        """
+        if session:
+            name = self._mk_session_name(name)
+
+        serializer = manager.serializer(self.cache_serializer)
+
+        if self.cache_store == 'sqlite':
+            row = self.cache_db.get(name)
+            if row is not None:
+                blob, updated, cached_validator = row
+                if validator is not None and cached_validator is not None:
+                    fresh = self._loads_cache(cached_validator) == validator
+                else:
+                    age = time.time() - updated
+                    fresh = age < max_age or max_age == 0
+
+                if fresh:
+                    return self._load_memo(
+                        name, updated,
+                        lambda: serializer.load(io.BytesIO(blob)))
+
+        else:
+            cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+
+            cached_validator = None
+            if validator is not None:
+                cached_validator = self._cached_validator(name)
+
+            if cached_validator is not None:
+                fresh = cached_validator == validator
+            else:
+                age = self.cached_data_age(name)
+                fresh = age < max_age or max_age == 0
+
+            if fresh and os.path.exists(cache_path):
+
+                def load():
+                    with open(cache_path, 'rb') as file_obj:
+                        return serializer.load(file_obj)
+
+                stat = os.stat(cache_path)
+                return self._load_memo(
+                    name, (stat.st_ino, stat.st_mtime_ns, stat.st_size), load)
+
+        if not data_func:
+            return None
+
+        data = data_func()
+        self.cache_data(name, data, validator=validator)
+
+        return data
+
+    def cached_data_or_stale(self, name, data_func=None, max_age=60,
+                             session=False, refresh=None, validator=None):
+        """Cache API that returns expired data instead of waiting for fresh.
+
+        Like :meth:`cached_data`, but if the cached data are older than
+        ``max_age``, they are returned anyway and ``refresh`` is called to
+        fetch fresh data in the background (e.g. via
+        :func:`~workflow.background.run_in_background`). ``data_func``
+        is only called if there are no cached data at all.
+
+        Callers can use the returned ``stale`` flag to tell the user,
+        or set :attr:`rerun` to pick up the fresh data once they have
+        been cached.
+
+        ``validator`` works as for :meth:`cached_data`: data saved with a
+        different validator are stale regardless of their age.
+
+        :param name: Name of datastore
+        :type name: ``str``
+        :param data_func: Callable that returns fresh data. It
+                is called if no cached data exist.
+        :type data_func: ``callable``
+        :param max_age: Maximum allowable age of cached data in seconds.
+        :type max_age: ``int``
+        :param session: Whether to scope the cache to the current session (optional).
+        :type session: ``bool``
+        :param refresh: Callable that starts refreshing the cache in the
+                background. It is called if stale data are returned.
+        :type refresh: ``callable``
+        :param validator: Current validator of the data (optional).
+        :returns: ``(data, stale)`` tuple. ``data`` is the cached data,
+            the return value of ``data_func`` or ``None``; ``stale`` is
+            ``True`` if ``data`` are older than ``max_age``.
+        :rtype: ``tuple``
+
+        """
+        data = self.cached_data(name, max_age=max_age, session=session,
+                                validator=validator)
+        if data is not None:
+            return data, False
+
+        data = self.cached_data(name, max_age=0, session=session)
+        if data is None:
+            if data_func:
+                data = data_func()
+                self.cache_data(name, data, session=session,
+                                validator=validator)
+            return data, False
+
+        self.logger.debug('cached data stale: %s', name)
+        if refresh:
+            refresh()
+
+        return data, True
+
+    def cache_data(self, name, data, session=False, validator=None):
+        """Cache API with session-scoped expiry.
+
+        Save ``data`` to cache under ``name``. If ``data`` is
+        ``None``, the corresponding cache file will be deleted.
+
+        ``validator`` is a cheap fingerprint of whatever ``data`` were
+        derived from, e.g. a tuple of directory mtimes, captured before
+        ``data`` were generated. It is saved alongside ``data`` and must
+        be supported by the cache serializer. :meth:`cached_data` then
+        considers ``data`` fresh for as long as the current validator
+        equals the saved one.
+
+        :param name: name of datastore
+        :type name: ``str``
+        :param data: Data to store. This may be any object supported by
+                the cache serializer
+        :type data: ``object``
+        param session: Whether to scope the cache to the
+                current session (optional).
+        :type session: ``bool``
+        :param validator: Validator of ``data`` (optional).
+
+        If ``session`` is ``True``, then ``name`` is prefixed
+        with :attr:`session_id`.
+
+        """
+        if session:
+            name = self._mk_session_name(name)
+
+        if self.cache_store == 'sqlite':
+            if data is None:
+                self.cache_db.delete(name)
+                self.logger.debug('deleted cached data: %s', name)
+                return
+
+            if validator is not None:
+                validator = self._dumps_cache(validator)
+            self.cache_db.put(name, self._dumps_cache(data), validator)
+            self.logger.debug('cached data: %s', name)
+            return
+
+        serializer = manager.serializer(self.cache_serializer)
+
+        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+        validator_path = self._validator_path(name)
+
+        # Remove the old validator first, so it can't validate new data
+        if os.path.exists(validator_path):
+            os.unlink(validator_path)
+
+        if data is None:
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+                self.logger.debug('deleted cache file: %s', cache_path)
+            return
+
+        with atomic_writer(cache_path, 'wb') as file_obj:
+            serializer.dump(data, file_obj)
+
+        if validator is not None:
+            with atomic_writer(validator_path, 'wb') as file_obj:
+                serializer.dump(validator, file_obj)
+
+        self.logger.debug('cached data: %s', cache_path)
+
+    def _validator_path(self, name):
+        """Path of the file the validator of cache ``name`` is saved in."""
+        return self.cachefile('%s.validator.%s' % (name, self.cache_serializer))
+
+    def _load_memo(self, name, stamp, load):
+        """Return cached data from :attr:`cache_memo` or ``load()``.
+
+        ``stamp`` identifies the version of the cached data, e.g. the
+        mtime of the cache file.
+
+        """
+        if self.cache_memo is not None:
+            # re-inserted, so the dict is ordered from least to most
+            # recently used
+            memo = self.cache_memo.pop(name, None)
+            if memo is not None and memo[0] == stamp:
+                self.logger.debug('cached data in memory: %s', name)
+                self.cache_memo[name] = memo
+                return memo[1]
+
+        self.logger.debug('loading cached data: %s', name)
+        with self.span('cache:%s' % name):
+            data = load()
+        if self.cache_memo is not None:
+            self.cache_memo[name] = (stamp, data)
+            while len(self.cache_memo) > CACHE_MEMO_SIZE:
+                del self.cache_memo[next(iter(self.cache_memo))]
+
+        return data
+
+    def _dumps_cache(self, obj):
+        """Serialize ``obj`` with the cache serializer."""
+        buf = io.BytesIO()
+        manager.serializer(self.cache_serializer).dump(obj, buf)
+        return buf.getvalue()
+
+    def _loads_cache(self, blob):
+        """Deserialize ``blob`` with the cache serializer."""
+        return manager.serializer(self.cache_serializer).load(io.BytesIO(blob))
+
+    def _cached_validator(self, name):
+        """Validator saved with cache ``name`` or ``None``."""
+        if self.cache_store == 'sqlite':
+            row = self.cache_db.get(name)
+            if row is None or row[2] is None:
+                return None
+            return self._loads_cache(row[2])
+
+        validator_path = self._validator_path(name)
+        if not os.path.exists(validator_path):
+            return None
+
+        import pickle
+        serializer = manager.serializer(self.cache_serializer)
+        try:
+            with open(validator_path, 'rb') as file_obj:
+                return serializer.load(file_obj)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def cached_data_valid(self, name, validator):
+        """Whether cache `name` was saved with validator `validator`.
+
+        :param name: name of datastore
+        :param validator: current validator of the data
+        :returns: ``True`` if the saved validator equals ``validator``,
+            else ``False``
+
+        """
+        if validator is None or self._cached_validator(name) != validator:
+            return False
+
+        if self.cache_store == 'sqlite':
+            return True
+
+        return os.path.exists(
+            self.cachefile('%s.%s' % (name, self.cache_serializer)))
+
+    def cached_data_age(self, name):
+        """Return age in seconds of cache `name` or 0 if cache doesn't exist.
+
+        The age of :data:`UPDATE_STATUS_KEY` is that of the file
+        ``update.py`` saves it in, see :meth:`_update_status_path`.
+
+        :param name: name of datastore
+        :type name: ``str``
+        :returns: age of datastore in seconds
+        :rtype: ``int``
+
+        """
+        if name == UPDATE_STATUS_KEY:
+            cache_path = self._update_status_path()
+        elif self.cache_store == 'sqlite':
+            updated = self.cache_db.updated(name)
+            return time.time() - updated if updated is not None else 0
+        else:
+            cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+
+        if not os.path.exists(cache_path):
+            return 0
+
+        return time.time() - os.stat(cache_path).st_mtime
+
+    def clear_cache(self, filter_func=lambda f: True):
+        """Delete all files in workflow's :attr:`cachedir`.
+
+        See :meth:`Workflow.clear_cache`. If :attr:`cache_store` is
+        ``sqlite``, ``filter_func`` is also called with the name of all
+        data in the store.
+
+        """
+        if self.cache_store == 'sqlite':
+            self.cache_db.clear(filter_func)
+
+            def _filter_func(filename, filter_func=filter_func):
+                # keep the store itself
+                return (not filename.startswith(CACHE_DB_NAME) and
+                        filter_func(filename))
+
+            filter_func = _filter_func
+
+        super().clear_cache(filter_func)
+
+    # Searching methods ------------------------------------------------
+
+    def filter_corpus(self, query, corpus, ascending=False,
+                      include_score=False, min_score=0, max_results=0,
+                      match_on=MATCH_ALL, fold_diacritics=True,
+                      narrow=None):
+        """Fuzzy search filter over a :class:`~search.Corpus`.
+
+        The search keys of ``corpus`` were computed when it was built, so
+        only the matching itself is done here. Results are the same as
+        those of :meth:`filter` called on ``corpus.items`` with the key
+        function the corpus was built with.
+
+        If ``narrow`` is set, the indices of the matching items are saved
+        in the session cache under that name. When the next query of the
+        same session extends this one (e.g. ``pyth`` -> ``pytho``), only
+        those items are tested again.
+
+        :param query: query to test items against
+        :type query: ``str``
+        :param corpus: prepared items to search
+        :type corpus: :class:`~search.Corpus`
+        :param narrow: Name of session cache to store matches in
+        :type narrow: ``str``
+
+        All other arguments are the same as for :meth:`filter`.
+
+        """
+        if not query:
+            return corpus.items
+
+        # Remove preceding/trailing spaces
+        query = query.strip()
+
+        if not query:
+            return corpus.items
+
+        # Use user override if there is one
+        fold_diacritics = self.settings.get('__workflow_diacritic_folding',
+                                            fold_diacritics)
+
+        candidates = None
+        if narrow:
+            last = self.cached_data(narrow, max_age=0, session=True)
+            if (last and last['checksum'] == corpus.checksum and
+                    last['match_on'] == match_on and
+                    last['fold_diacritics'] == fold_diacritics and
+                    narrows(last['query'], query, match_on)):
+                self.logger.debug('narrowing %d match(es) of "%s"',
+                                  len(last['matches']), last['query'])
+                candidates = last['matches']
+
+        matches = corpus.match(query, match_on, fold_diacritics, candidates)
+
+        if narrow:
+            from array import array
+
+            self.cache_data(narrow, {
+                'query': query,
+                'match_on': match_on,
+                'fold_diacritics': fold_diacritics,
+                'checksum': corpus.checksum,
+                'matches': array('I', [m[0] for m in matches]),
+            }, session=True)
+
+        return rank(corpus.results(matches), ascending, include_score,
+                    min_score, max_results)
+
+    # Running methods --------------------------------------------------
+
+    def run(self, func, text_errors=False):
+        """Call ``func`` to run your workflow, see :meth:`Workflow.run`.
+
+        The phases of the run are timed (see :meth:`span`), and the run is
+        profiled if :data:`PROFILE_ENV` or the ``workflow:profile`` and
+        ``workflow:profilemem`` magic arguments ask for it.
+
+        """
+        start = time.time()
+        # CPU time Python took to start and import the workflow's modules.
+        # Only the first run of a process (see `server.py`) has to.
+        if not AppWorkflow._startup_timed:
+            AppWorkflow._startup_timed = True
+            self.spans.insert(0, ('import', time.process_time()))
+
+        def main(wf):
+            profile = self._profile_mode()
+            if profile:
+                self._run_profiled(func, memory=profile == 'memory')
+            else:
+                func(self)
+
+        try:
+            return super().run(main, text_errors)
+        finally:
+            duration = time.time() - start
+            self.logger.debug('timings: %s', self._format_spans())
+            if self.debugging or os.getenv(METRICS_ENV):
+                self._save_metrics(duration)
+
+    # Profiling methods ------------------------------------------------
+
+    def _profile_mode(self):
+        """How to profile this run: ``cpu``, ``memory`` or ``None``.
+
+        Set by :data:`PROFILE_ENV` or the ``workflow:profile`` and
+        ``workflow:profilemem`` magic arguments, which may be appended
+        to a query as its last word and are removed from it.
+
+        """
+        mode = None
+        env = os.getenv(PROFILE_ENV)
+        if env:
+            mode = 'memory' if env == 'memory' else 'cpu'
+
+        if self._capture_args:
+            modes = {self.magic_prefix + 'profile': 'cpu',
+                     self.magic_prefix + 'profilemem': 'memory'}
+            for i, arg in enumerate(sys.argv[1:], 1):
+                words = arg.rsplit(None, 1)
+                if words and words[-1] in modes:
+                    sys.argv[i] = words[0] if len(words) == 2 else ''
+                    mode = mode or modes[words[-1]]
+
+        return mode
+
+    def _run_profiled(self, func, memory=False):
+        """Call ``func`` with :mod:`cProfile` (and :mod:`tracemalloc`).
+
+        A ``.prof`` file with the profile, which e.g. :mod:`pstats` or
+        ``snakeviz`` can read, and a ``.txt`` report with the slowest
+        functions (and biggest allocations) are saved in
+        :data:`PROFILE_DIR_NAME` in the cache directory. Reports of the
+        last :data:`PROFILE_MAX_RUNS` runs are kept.
+
+        """
+        import cProfile
+        import tracemalloc
+
+        if memory:
+            tracemalloc.start()
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(func, self)
+        finally:
+            snapshot = None
+            if memory:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+
+            # an error saving the profile mustn't replace one of `func`
+            try:
+                self._save_profile(profiler, snapshot)
+            except Exception as err:
+                self.logger.exception('could not save profile: %s', err)
+
+    def _save_profile(self, profiler, snapshot=None):
+        """Save profile and report, and delete those of older runs."""
+        import pstats
+
+        dirpath = self._create(self.cachefile(PROFILE_DIR_NAME))
+        now = time.time()
+        basepath = os.path.join(dirpath, '{0}.{1:03d}-{2}'.format(
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+            int(now * 1000) % 1000, os.getpid()))
+        profiler.dump_stats(basepath + '.prof')
+
+        with open(basepath + '.txt', 'w') as file_obj:
+            file_obj.write('{0}\n\n'.format(' '.join(sys.argv)))
+            stats = pstats.Stats(profiler, stream=file_obj)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+
+            if snapshot is not None:
+                file_obj.write('Top {0} allocations:\n\n'.format(
+                    PROFILE_TOP))
+                for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+                    file_obj.write('{0}\n'.format(stat))
+
+        self.logger.debug('profile saved to %s.prof', basepath)
+
+        # delete reports of older runs
+        runs = sorted({os.path.splitext(filename)[0]
+                       for filename in os.listdir(dirpath)})
+        for run in runs[:-PROFILE_MAX_RUNS]:
+            for ext in ('.prof', '.txt'):
+                path = os.path.join(dirpath, run + ext)
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    # Timing methods ---------------------------------------------------
+
+    @contextmanager
+    def span(self, name):
+        """Context manager that times a phase of the run.
+
+        The duration is appended to :attr:`spans`. :meth:`run` saves the
+        spans of the run to :data:`METRICS_NAME` in the cache directory if
+        Alfred's debugger is open or :data:`METRICS_ENV` is set. If the
+        debugger is open, :meth:`send_feedback` also adds an item with the
+        timings so far.
+
+        Spans may be nested, e.g. ``cache:<name>`` spans are recorded
+        within a ``filter`` span.
+
+        Example::
+
+            with wf.span('filter'):
+                items = wf.filter(query, items)
+
+        :param name: Name of the phase
+        :type name: ``str``
+
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, time.perf_counter() - start))
+
+    def _format_spans(self):
+        """Summary of :attr:`spans` in milliseconds."""
+        return ', '.join('{0} {1:0.1f}ms'.format(name, duration * 1000)
+                         for name, duration in self.spans)
+
+    def _save_metrics(self, duration):
+        """Append timings of the run to the metrics file.
+
+        Only the last :data:`METRICS_MAX_RUNS` runs are kept.
+
+        """
+        metrics = {
+            'time': time.time(),
+            'total': round(duration * 1000, 3),
+            'spans': [[name, round(seconds * 1000, 3)]
+                      for name, seconds in self.spans],
+        }
+        metrics_path = self.cachefile(METRICS_NAME)
+        try:
+            lines = []
+            if os.path.exists(metrics_path):
+                with open(metrics_path, 'r') as file_obj:
+                    lines = file_obj.readlines()[-(METRICS_MAX_RUNS - 1):]
+            lines.append(json.dumps(metrics) + '\n')
+            with atomic_writer(metrics_path, 'w') as file_obj:
+                file_obj.writelines(lines)
+        except OSError as err:  # pragma: no cover
+            self.logger.warning('could not save timings: %s', err)
+
+    # Alfred feedback methods ------------------------------------------
+
+    def add_item(self, *args, **kwargs):
+        """Add an item to be output to Alfred, see :meth:`Workflow.add_item`."""
+        start = time.perf_counter()
+        item = super().add_item(*args, **kwargs)
+        self._items_time += time.perf_counter() - start
+        return item
+
+    def send_feedback(self):
+        """Print stored items to console/Alfred as JSON.
+
+        Adds an item with the timings of the run if Alfred's debugger
+        is open.
+
+        """
+        if self._items:
+            self.spans.append(('items', self._items_time))
+
+        if self.debugging:
+            self.add_item('Timings', self._format_spans(), icon=ICON_CLOCK)
+        with self.span('feedback'):
+            super().send_feedback()
+
+    # Updating methods -------------------------------------------------
+
+    @property
+    def update_available(self):
+        """Whether an update is available, see :attr:`Workflow.update_available`."""
+        status = None
+        cache_path = self._update_status_path()
+        if os.path.exists(cache_path):
+            with open(cache_path, 'rb') as file_obj:
+                status = manager.serializer('pickle').load(file_obj)
+
+        if not status or not status.get('available'):
+            return False
+
+        return status['available']
+
+    def check_update(self, force=False):
+        """Call update script if it's time to check for a new release.
+
+        See :meth:`Workflow.check_update`. Timed by :meth:`span`. Like
+        :attr:`update_available`, it looks the status of the last check up
+        where ``update.py`` saved it (see :meth:`cached_data_age`).
+
+        """
+        with self.span('update'):
+            super().check_update(force)
+
+    def _update_status_path(self):
+        """Path of the status of update checks.
+
+        ``update.py`` is called without the user's settings, so the status
+        is a pickle file in :attr:`cachedir` whatever :attr:`cache_store`
+        and :attr:`cache_serializer` are.
+
+        """
+        return self.cachefile('%s.pickle' % UPDATE_STATUS_KEY)
+
+    # Magic arguments --------------------------------------------------
+
+    def _show_stats(self):
+        """Display latencies of the commands run so far in Alfred."""
+        from tracer import BUCKETS
+        stats = self.command_tracer.stats()
+        if not stats:
+            return 'No commands have been run yet'
+
+        def fmt(milliseconds):
+            if milliseconds is None:
+                return '>{0}s'.format(BUCKETS[-1] // 1000)
+            return '<{0}ms'.format(milliseconds)
+
+        for command in stats:
+            subtitle = 'p50 {0} · p95 {1} · {2} calls · {3} failed · '\
+                '{4:0.1f} KB output'.format(
+                    fmt(command['p50']), fmt(command['p95']),
+                    command['count'], command['failures'],
+                    command['stdout_bytes'] / 1024.0)
+            self.logger.debug('%s: %s', command['name'], subtitle)
+            self.add_item(command['name'], subtitle, icon=ICON_CLOCK)
+
+        if not sys.stdout.isatty():
+            self.send_feedback()
+        sys.exit(0)
+
+    # Helper methods ---------------------------------------------------
+
+    def _load_info_metadata(self):
+        """Load :attr:`info_metadata` from cache or ``info.plist``."""
+        mtime = os.stat(self.workflowfile('info.plist')).st_mtime_ns
+        cache_path = None
+        if self.alfred_env.get('workflow_cache'):
+            cache_path = self.cachefile(INFO_CACHE_NAME)
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as file_obj:
+                    metadata = json.load(file_obj)
+            except ValueError:
+                metadata = {}
+
+            if metadata.get('mtime') == mtime:
+                return metadata
+
+        # no logging here: the path of the log file needs the bundle ID
+        metadata = {
+            'bundleid': self.info.get('bundleid'),
+            'name': self.info.get('name'),
+            'version': self.info.get('version'),
+            'mtime': mtime,
+        }
+        if cache_path:
+            with atomic_writer(cache_path, 'w') as file_obj:
+                json.dump(metadata, file_obj)
+
+        return metadata
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+import compileall
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import brew
+import cask
+import helpers
+import refresh
+from appworkflow import UPDATE_STATUS_KEY, AppWorkflow
+from search import Corpus, subsequence_end
+from workflow import MATCH_ALLCHARS, Workflow, background, manager
+
+# Size of the synthetic formula catalogue
+CATALOGUE_SIZE = 7000
+
+# Maximum time `import brew` may take in seconds, excluding interpreter startup
+IMPORT_TIME_BUDGET = 0.05
+
+# Modules that are only needed on rare paths and must not be imported on startup
+LAZY_MODULES = ('subprocess', 'plistlib', 'shutil', 'hashlib', 'binascii')
+
+QUERIES = ['py', 'pyth', 'gcc', 'nodejs', 'lbxml2', 'zzzz']
+
+# Size of the synthetic cask catalogue and number of installed formulae/casks
+CASK_CATALOGUE_SIZE = 6000
+INSTALLED_COUNT = 300
+
+# Seconds the fake `brew` takes to answer, besides starting a shell
+FAKE_BREW_LATENCY = 0.05
+
+# Maximum median time of a keystroke in seconds, with and without cached lists
+WARM_BUDGET = 0.05
+COLD_BUDGET = 0.5
+
+# Keystrokes of the end-to-end benchmark: script filter and query
+SCENARIOS = [(script, query)
+             for script in ('brew', 'cask')
+             for query in ('install', 'install py', 'uninstall', 'outdated', '')]
+
+# Stand-in for `brew` answering the commands the script filters run from files
+FAKE_BREW = """#!/bin/sh
+sleep "${FAKE_BREW_LATENCY:-0}"
+data="$(dirname "$0")/../data"
+case "$*" in
+    formulae) cat "$data/formulae" ;;
+    casks) cat "$data/casks" ;;
+    'list --versions') cat "$data/installed" ;;
+    'list --pinned --versions') ;;
+    'list --cask'*) cat "$data/installed_casks" ;;
+    'outdated --formula') cat "$data/outdated" ;;
+    'outdated --cask'*) cat "$data/outdated_casks" ;;
+    *) echo "Error: Unknown command: $1" >&2; exit 1 ;;
+esac
+"""
+
+
+def synthetic_names(count, seed=0):
+    """ Formula-like names, e.g. `lib-foo@2`, `python-bar`. """
+    rng = random.Random(seed)
+    words = [''.join(rng.choice(string.ascii_lowercase)
+                     for _ in range(rng.randint(2, 8)))
+             for _ in range(500)] + ['python', 'node', 'gcc', 'lib', 'xml']
+    names = set()
+    while len(names) < count:
+        name = '-'.join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+        if rng.random() < 0.1:
+            name += '@%d' % rng.randint(1, 20)
+        names.add(name)
+    return sorted(names)
+
+
+def best_of(func, repeat=5):
+    """ Best wall time of `repeat` calls of `func`. """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def report(name, seconds):
+    print('%-40s %8.2f ms' % (name, seconds * 1000))
+
+
+# Loads a cache file in a fresh interpreter and prints by how much it grew the RSS (KiB).
+# Without /proc, the peak RSS is used, which is in bytes on macOS.
+RSS_SCRIPT = """
+import resource, sys
+import strtab
+from workflow import manager
+
+def rss():
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss // 1024 if sys.platform == 'darwin' else rss
+
+serializer = manager.serializer(sys.argv[1])
+before = rss()
+with open(sys.argv[2], 'rb') as fp:
+    data = serializer.load(fp)
+data[:200]
+print(rss() - before)
+"""
+
+
+def load_rss(serializer, path):
+    """ RSS growth in KiB caused by loading `path` with `serializer`. """
+    output = subprocess.check_output([sys.executable, '-c', RSS_SCRIPT, serializer, path],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return int(output)
+
+
+class FilterBenchmarkCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.wf = AppWorkflow()
+        cls.names = synthetic_names(CATALOGUE_SIZE)
+        cls.corpus = Corpus(cls.names)
+
+    def test_allchars_subsequence_vs_regex(self):
+        lower = [name.lower() for name in self.names]
+
+        def regex_scores():
+            for query in QUERIES:
+                search = re.compile(''.join('.*?%s' % re.escape(c) for c in query),
+                                    re.IGNORECASE).search
+                for name in self.names:
+                    match = search(name)
+                    if match:
+                        100.0 / ((1 + match.start()) * (match.end() - match.start() + 1))
+
+        def subsequence_scores():
+            for query in QUERIES:
+                for name in lower:
+                    end = subsequence_end(name, query)
+                    if end:
+                        100.0 / (end + 1)
+
+        regex = best_of(regex_scores)
+        subsequence = best_of(subsequence_scores)
+        report('MATCH_ALLCHARS regex', regex)
+        report('MATCH_ALLCHARS subsequence_end', subsequence)
+        self.assertLess(subsequence, regex)
+
+    def test_allchars_filter_corpus(self):
+        def corpus_filter():
+            for query in QUERIES:
+                self.wf.filter_corpus(query, self.corpus, match_on=MATCH_ALLCHARS)
+
+        report('filter_corpus MATCH_ALLCHARS', best_of(corpus_filter))
+
+
+class SerializerBenchmarkCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.names = synthetic_names(CATALOGUE_SIZE)
+        cls.tempdir = tempfile.mkdtemp()
+        cls.paths = {}
+        for name in ('pickle', 'json', 'strtab'):
+            cls.paths[name] = os.path.join(cls.tempdir, 'names.%s' % name)
+            with open(cls.paths[name], 'wb') as fp:
+                manager.serializer(name).dump(cls.names, fp)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
+    def load(self, name):
+        with open(self.paths[name], 'rb') as fp:
+            return manager.serializer(name).load(fp)
+
+    def test_load(self):
+        timings = {}
+        for name in self.paths:
+            timings[name] = best_of(lambda: self.load(name)[:200], repeat=20)
+            report('load %d names, first 200 (%s)' % (CATALOGUE_SIZE, name), timings[name])
+            print('%-40s %8d KiB' % ('RSS growth (%s)' % name, load_rss(name, self.paths[name])))
+        self.assertEqual(self.load('strtab'), self.names)
+        self.assertLess(timings['strtab'], timings['pickle'])
+        self.assertLess(timings['strtab'], timings['json'])
+
+
+def install_fake_brew(root, formulae, casks):
+    """ Write the fake `brew` and its data to `root`. Returns the path of the executable. """
+    rng = random.Random(0)
+    installed = sorted(rng.sample(formulae, INSTALLED_COUNT))
+    installed_casks = sorted(rng.sample(casks, INSTALLED_COUNT))
+    data = {
+        'formulae': formulae,
+        'casks': casks,
+        'installed': ['%s 1.0' % name for name in installed],
+        'installed_casks': installed_casks,
+        'outdated': installed[::10],
+        'outdated_casks': installed_casks[::10],
+    }
+    for dirname in ('bin', 'data'):
+        os.mkdir(os.path.join(root, dirname))
+    for name, lines in data.items():
+        with open(os.path.join(root, 'data', name), 'w') as fp:
+            fp.write(''.join('%s\n' % line for line in lines))
+    path = os.path.join(root, 'bin', 'brew')
+    with open(path, 'w') as fp:
+        fp.write(FAKE_BREW)
+    os.chmod(path, 0o755)
+    return path
+
+
+class KeystrokeBenchmarkCase(unittest.TestCase):
+    """
+    Runs `main` of the script filters like Alfred does for a keystroke, with a fake `brew`
+    on the `PATH` and without a Cellar or API cache, so every list comes from `brew`.
+    Background jobs are recorded, not started.
+    """
+
+    @classmethod
+    def patch(cls, patcher):
+        """ Start `patcher` until the tests of the class have run. """
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.tempdir)
+        brew_file = install_fake_brew(cls.tempdir, synthetic_names(CATALOGUE_SIZE),
+                                      synthetic_names(CASK_CATALOGUE_SIZE, seed=1))
+        cls.cachedir = os.path.join(cls.tempdir, 'cache')
+        datadir = os.path.join(cls.tempdir, 'data', 'workflow')
+        os.makedirs(datadir)
+        with open(os.path.join(datadir, 'settings.json'), 'w') as fp:
+            json.dump({'HOMEBREW_OPTS': {'current_brew': 'ARM'}}, fp)
+
+        # `patch.dict` restores the whole environment, including the `PATH` set by
+        # `helpers.initialise_path`
+        cls.patch(mock.patch.dict(os.environ, {
+            'alfred_workflow_cache': cls.cachedir,
+            'alfred_workflow_data': datadir,
+            'HOMEBREW_PREFIX': os.path.join(cls.tempdir, 'prefix'),
+            'HOMEBREW_CACHE': os.path.join(cls.tempdir, 'homebrew-cache'),
+            'FAKE_BREW_LATENCY': str(FAKE_BREW_LATENCY),
+        }))
+        # `helpers.initialise_path` puts the ARM brew first on the `PATH`
+        cls.patch(mock.patch.dict(helpers.BREW_VERSIONS, {
+            'ARM': {'PATH': os.path.dirname(brew_file), 'FILE': brew_file}}))
+        cls.patch(mock.patch.object(sys, 'argv', list(sys.argv)))
+
+        cls.jobs = []
+        # `background` starts the library's update checks
+        for module in (brew, cask, helpers, background):
+            cls.patch(mock.patch.object(module, 'run_in_background',
+                                        lambda name, args: cls.jobs.append(name)))
+        # `main` of the script filters uses the module's `wf`
+        for module in (brew, cask):
+            cls.patch(mock.patch.object(module, 'wf', None, create=True))
+
+    def keystroke(self, script, query):
+        """ Run the script filter `script` for `query`. Returns its duration and items. """
+        module = {'brew': brew, 'cask': cask}[script]
+        sys.argv = ['%s.py' % script, query]
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            wf = module.create_workflow()
+            module.wf = wf
+            status = wf.run(module.main)
+        duration = time.perf_counter() - start
+        self.assertEqual(status, 0)
+        return duration, json.loads(output.getvalue())['items']
+
+    def clear_cache(self):
+        shutil.rmtree(self.cachedir, ignore_errors=True)
+        os.mkdir(self.cachedir)
+
+    def seed_status(self):
+        """ Record a refresh and an update check that just finished, as their jobs would. """
+        refresh.update_status(brew.create_workflow(), time.time(),
+                              dict.fromkeys(helpers.REFRESH_MAX_AGES, 0.1))
+        # `update.py` saves the status with a `Workflow` without the workflow's settings
+        Workflow().cache_data(UPDATE_STATUS_KEY, {'available': False, 'download': None,
+                                                  'version': None})
+
+    def test_keystrokes(self):
+        print('\n%-26s %10s %10s %6s' % ('scenario', 'cold', 'warm', 'items'))
+        for script, query in SCENARIOS:
+            cold = []
+            for _ in range(3):
+                self.clear_cache()
+                cold.append(self.keystroke(script, query)[0])
+            # with all lists current, typing must not start any job
+            self.seed_status()
+            del self.jobs[:]
+            warm = []
+            for _ in range(7):
+                duration, items = self.keystroke(script, query)
+                warm.append(duration)
+            cold, warm = statistics.median(cold), statistics.median(warm)
+            print('%-26s %7.1f ms %7.1f ms %6d' % ('%s %r' % (script, query),
+                                                   cold * 1000, warm * 1000, len(items)))
+            self.assertTrue(items)
+            self.assertLess(cold, COLD_BUDGET, '%s %r' % (script, query))
+            self.assertLess(warm, WARM_BUDGET, '%s %r' % (script, query))
+            self.assertEqual(self.jobs, [], '%s %r' % (script, query))
+
+
+def import_times(module):
+    """ Cumulative import times in seconds of `module` and all modules it imports. """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+class StartupBenchmarkCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Measure imports, not compiling
+        compileall.compile_dir(os.path.dirname(os.path.abspath(__file__)), quiet=1)
+
+    def test_import_brew(self):
+        runs = [import_times('brew') for _ in range(7)]
+        total = statistics.median(times['brew'] for times in runs)
+        report('import brew (median of %d)' % len(runs), total)
+        slowest = sorted(runs[0].items(), key=lambda item: -item[1])[1:6]
+        for name, seconds in slowest:
+            report('  %s' % name, seconds)
+        self.assertLess(total, IMPORT_TIME_BUDGET)
+        self.assertEqual([name for name in LAZY_MODULES if name in runs[0]], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
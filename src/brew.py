@@ -2,13 +2,15 @@
 # encoding: utf-8
 
 import os
-import subprocess
 import sys
 
 import brew_actions
+import catalogue
+import cellar
 import helpers
-from workflow import MATCH_SUBSTRING, Workflow
-from workflow.background import run_in_background
+from appworkflow import AppWorkflow
+from jobs import run_in_background
+from workflow import MATCH_SUBSTRING
 
 GITHUB_SLUG = 'fniephaus/alfred-homebrew'
 
@@ -16,28 +18,42 @@ GITHUB_SLUG = 'fniephaus/alfred-homebrew'
 def execute(wf, cmd_list):
     brew_arch = helpers.get_brew_arch(wf)
     new_env = helpers.initialise_path(brew_arch)
-    result, err = subprocess.Popen(cmd_list,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                env=new_env).communicate()
-    if err:
-        return 'Error: %s' % str(err, 'utf-8')
-    return str(result, 'utf-8')
-
-
-def get_all_formulae():
+    result = wf.command_tracer.run(cmd_list, env=new_env)
+    # brew also warns on stderr, e.g. about deprecations, which doesn't mean it failed
+    if result.returncode:
+        return 'Error: %s' % str(result.stderr, 'utf-8')
+    return str(result.stdout, 'utf-8')
+
+
+def get_all_formulae(formulae=None):
+    """ `formulae` is the formula catalogue, if the caller has loaded it already. """
+    formulae = formulae or catalogue.get_catalogue(wf, 'formula')
+    if formulae is not None:
+        # the API files only list the core taps' formulae
+        return sorted(formulae['names'] + cellar.tap_names(helpers.get_brew_prefix(wf), 'formula'))
     return execute(wf, ['brew', 'formulae']).splitlines()
 
 
 def get_installed_formulae():
+    formulae = cellar.installed_formulae(helpers.get_brew_prefix(wf))
+    if formulae is not None:
+        return formulae
     return execute(wf, ['brew', 'list', '--versions']).splitlines()
 
 
 def get_pinned_formulae():
+    formulae = cellar.pinned_formulae(helpers.get_brew_prefix(wf))
+    if formulae is not None:
+        return formulae
     return execute(wf, ['brew', 'list', '--pinned', '--versions']).splitlines()
 
 
-def get_outdated_formulae():
+def get_outdated_formulae(formulae=None):
+    formulae = formulae or catalogue.get_catalogue(wf, 'formula')
+    if formulae is not None:
+        outdated = cellar.outdated_formulae(helpers.get_brew_prefix(wf), formulae['metadata'])
+        if outdated is not None:
+            return outdated
     return execute(wf, ['brew', 'outdated', '--formula']).splitlines()
 
 
@@ -64,43 +80,19 @@ def get_all_services():
 
 
 def filter_all_formulae(wf, query):
-    formulae = wf.cached_data('brew_all_formulae',
-                              get_all_formulae,
-                              max_age=3600)
-    query_filter = query.split()
-    if len(query_filter) > 1:
-        return wf.filter(query_filter[1], formulae, match_on=MATCH_SUBSTRING)
-    return formulae
+    return helpers.filter_list(wf, 'brew_all_formulae', get_all_formulae, query)
 
 
 def filter_installed_formulae(wf, query):
-    formulae = wf.cached_data('brew_installed_formulae',
-                              get_installed_formulae,
-                              max_age=3600)
-    query_filter = query.split()
-    if len(query_filter) > 1:
-        return wf.filter(query_filter[1], formulae, match_on=MATCH_SUBSTRING)
-    return formulae
+    return helpers.filter_list(wf, 'brew_installed_formulae', get_installed_formulae, query)
 
 
 def filter_pinned_formulae(wf, query):
-    formulae = wf.cached_data('brew_pinned_formulae',
-                              get_pinned_formulae,
-                              max_age=3600)
-    query_filter = query.split()
-    if len(query_filter) > 1:
-        return wf.filter(query_filter[1], formulae, match_on=MATCH_SUBSTRING)
-    return formulae
+    return helpers.filter_list(wf, 'brew_pinned_formulae', get_pinned_formulae, query)
 
 
 def filter_outdated_formulae(wf, query):
-    formulae = wf.cached_data('brew_outdated_formulae',
-                              get_outdated_formulae,
-                              max_age=3600)
-    query_filter = query.split()
-    if len(query_filter) > 1:
-        return wf.filter(query_filter[1], formulae, match_on=MATCH_SUBSTRING)
-    return formulae
+    return helpers.filter_list(wf, 'brew_outdated_formulae', get_outdated_formulae, query)
 
 
 def filter_all_services(wf, query):
@@ -156,10 +148,12 @@ def main(wf):
         # extract query
         query = wf.args[0] if len(wf.args) else None
 
+        # a new Alfred session has started, drop data of earlier ones
+        if not os.getenv('_WF_SESSION_ID'):
+            wf.clear_session_cache()
+
         if (not query and
-                len(wf.cached_data('brew_outdated_formulae',
-                                   get_outdated_formulae,
-                                   max_age=3600)) > 0):
+                len(helpers.get_cached(wf, 'brew_outdated_formulae', get_outdated_formulae)) > 0):
             wf.add_item('Some of your formulae are outdated!',
                         autocomplete='outdated ',
                         valid=False,
@@ -212,7 +206,7 @@ def main(wf):
                             valid=True,
                             icon=helpers.get_icon(wf, 'package'))
                 # delete cached file
-                wf.cache_data('brew_pinned_formulae', None)
+                helpers.cache_list(wf, 'brew_pinned_formulae', None)
         elif query and query.startswith('unpin'):
             for formula in filter_pinned_formulae(wf, query):
                 name = formula.rsplit()[0]
@@ -221,7 +215,7 @@ def main(wf):
                             valid=True,
                             icon=helpers.get_icon(wf, 'package'))
                 # delete cached file
-                wf.cache_data('brew_pinned_formulae', None)
+                helpers.cache_list(wf, 'brew_pinned_formulae', None)
         elif query and query.startswith('cat'):
             for formula in filter_all_formulae(wf, query):
                 name = formula.rsplit()[0]
@@ -252,10 +246,9 @@ def main(wf):
                         autocomplete='',
                         icon=helpers.get_icon(wf, 'info'))
         else:
-            actions = brew_actions.ACTIONS
-            if len(wf.cached_data('brew_pinned_formulae',
-                                  get_pinned_formulae,
-                                  max_age=3600)) > 0:
+            # copy, as the query server runs `main` for many queries
+            actions = list(brew_actions.ACTIONS)
+            if len(helpers.get_cached(wf, 'brew_pinned_formulae', get_pinned_formulae)) > 0:
                 actions.append({
                     'name': 'Unpin',
                     'description': 'Unpin formula.',
@@ -265,9 +258,10 @@ def main(wf):
                 })
             # filter actions by query
             if query:
-                actions = wf.filter(query, actions,
-                                    key=helpers.search_key_for_action,
-                                    match_on=MATCH_SUBSTRING)
+                with wf.span('filter'):
+                    actions = wf.filter(query, actions,
+                                        key=helpers.search_key_for_action,
+                                        match_on=MATCH_SUBSTRING)
 
             if len(actions) > 0:
                 for action in actions:
@@ -291,10 +285,17 @@ def main(wf):
     wf.send_feedback()
 
     # refresh cache
-    cmd = ['/usr/bin/env', 'python3', wf.workflowfile('brew_refresh.py')]
-    run_in_background('brew_refresh', cmd)
+    if helpers.refresh_due(wf):
+        with wf.span('background'):
+            run_in_background('refresh', helpers.refresh_command(wf))
+
+
+def create_workflow():
+    wf = AppWorkflow(update_settings={'github_slug': GITHUB_SLUG})
+    helpers.setup_cache(wf)
+    return wf
 
 
 if __name__ == '__main__':
-    wf = Workflow(update_settings={'github_slug': GITHUB_SLUG})
+    wf = create_workflow()
     sys.exit(wf.run(main))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+SQLite cache store for `AppWorkflow`.
+
+By default, `Workflow.cache_data` writes one file per key and
+`Workflow.cached_data` checks its age with a `stat` call. With
+`AppWorkflow.cache_store` set to `sqlite`, cached data are stored in
+a single SQLite database instead, with the time every key was last updated
+in the same row. Several keys can then be written in one transaction
+(see `AppWorkflow.cache_transaction`), and the database runs in WAL
+mode, so script filters can read while a background job writes.
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = ['CacheDB']
+
+#: Seconds to wait for a write lock held by another process
+TIMEOUT = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    name TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    updated REAL NOT NULL,
+    validator BLOB
+)
+"""
+
+
+class CacheDB(object):
+    """Serialized cache data in a SQLite database.
+
+    Every thread uses its own connection. Data and validators are stored
+    as ``bytes``; serializing them is up to the caller.
+
+    :param path: Path to the database file.
+    :type path: ``str``
+
+    """
+
+    def __init__(self, path):
+        """Create new CacheDB at ``path``."""
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """Connection of the current thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Transactions are managed by `transaction()`
+            conn = sqlite3.connect(self.path, timeout=TIMEOUT,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(SCHEMA)
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    def get(self, name):
+        """Return ``(data, updated, validator)`` of ``name`` or ``None``.
+
+        :param name: Cache key
+        :type name: ``str``
+        :returns: Row of ``name``
+        :rtype: ``tuple``
+
+        """
+        return self.connection.execute(
+            'SELECT data, updated, validator FROM cache WHERE name = ?',
+            (name,)).fetchone()
+
+    def updated(self, name):
+        """Return time ``name`` was last updated or ``None``.
+
+        :param name: Cache key
+        :type name: ``str``
+        :rtype: ``float``
+
+        """
+        row = self.connection.execute(
+            'SELECT updated FROM cache WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, name, data, validator=None):
+        """Save ``data`` and ``validator`` under ``name``.
+
+        :param name: Cache key
+        :type name: ``str``
+        :param data: Serialized data
+        :type data: ``bytes``
+        :param validator: Serialized validator (optional)
+        :type validator: ``bytes``
+
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO cache (name, data, updated, validator) '
+            'VALUES (?, ?, ?, ?)', (name, data, time.time(), validator))
+
+    def delete(self, name):
+        """Delete ``name``.
+
+        :param name: Cache key
+        :type name: ``str``
+
+        """
+        self.connection.execute('DELETE FROM cache WHERE name = ?', (name,))
+
+    def names(self):
+        """Return names of all cached data.
+
+        :rtype: ``list``
+
+        """
+        return [row[0] for row in
+                self.connection.execute('SELECT name FROM cache')]
+
+    def clear(self, filter_func=lambda name: True):
+        """Delete all data whose name ``filter_func`` returns ``True`` for.
+
+        :param filter_func: Callable to determine whether data should be
+            deleted or not.
+        :type filter_func: ``callable``
+
+        """
+        with self.transaction():
+            for name in self.names():
+                if filter_func(name):
+                    self.delete(name)
+
+    @contextmanager
+    def transaction(self):
+        """Context manager that writes all changes at once or not at all.
+
+        Transactions may be nested; only the outermost one commits.
+
+        """
+        conn = self.connection
+        if self._local.depth == 0:
+            conn.execute('BEGIN IMMEDIATE')
+        self._local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute('ROLLBACK')
+            raise
+        else:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute('COMMIT')
+
+    def close(self):
+        """Close the connection of the current thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -2,13 +2,15 @@
 # encoding: utf-8
 
 import os
-import subprocess
 import sys
 
 import cask_actions
+import catalogue
+import cellar
 import helpers
-from workflow import MATCH_SUBSTRING, Workflow
-from workflow.background import run_in_background
+from appworkflow import AppWorkflow
+from jobs import run_in_background
+from workflow import MATCH_SUBSTRING
 
 GITHUB_SLUG = 'fniephaus/alfred-homebrew'
 OPEN_HELP = 'open https://github.com/fniephaus/alfred-homebrew && exit'
@@ -23,55 +25,48 @@ def execute(wf, cmd_list):
     brew_arch = helpers.get_brew_arch(wf)
 
     new_env = helpers.initialise_path(brew_arch)
-    result, err = subprocess.Popen(cmd_list,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE,
-                                   env=new_env).communicate()
-    if err:
-        return 'Error: %s' % str(err, 'utf-8')
-    return str(result, 'utf-8')
-
-
-def get_all_casks():
+    result = wf.command_tracer.run(cmd_list, env=new_env)
+    # brew also warns on stderr, e.g. about deprecations, which doesn't mean it failed
+    if result.returncode:
+        return 'Error: %s' % str(result.stderr, 'utf-8')
+    return str(result.stdout, 'utf-8')
+
+
+def get_all_casks(casks=None):
+    """ `casks` is the cask catalogue, if the caller has loaded it already. """
+    casks = casks or catalogue.get_catalogue(wf, 'cask')
+    if casks is not None:
+        # the API files only list the core taps' casks
+        return sorted(casks['names'] + cellar.tap_names(helpers.get_brew_prefix(wf), 'cask'))
     return execute(wf, ['brew', 'casks']).splitlines()
 
 
 def get_installed_casks():
+    casks = cellar.installed_casks(helpers.get_brew_prefix(wf))
+    if casks is not None:
+        return casks
     return execute(wf, ['brew', 'list', '--cask']).splitlines()
 
 
-def get_outdated_casks():
+def get_outdated_casks(casks=None):
+    casks = casks or catalogue.get_catalogue(wf, 'cask')
+    if casks is not None:
+        outdated = cellar.outdated_casks(helpers.get_brew_prefix(wf), casks['metadata'])
+        if outdated is not None:
+            return outdated
     return execute(wf, ['brew', 'outdated', '--cask']).splitlines()
 
 
 def filter_all_casks(wf, query):
-    formulas = wf.cached_data('cask_all_casks',
-                              get_all_casks,
-                              max_age=3600)
-    query_filter = query.split()
-    if len(query_filter) > 1:
-        return wf.filter(query_filter[1], formulas, match_on=MATCH_SUBSTRING)
-    return formulas
+    return helpers.filter_list(wf, 'cask_all_casks', get_all_casks, query)
 
 
 def filter_installed_casks(wf, query):
-    formulas = wf.cached_data('cask_installed_casks',
-                              get_installed_casks,
-                              max_age=3600)
-    query_filter = query.split()
-    if len(query_filter) > 1:
-        return wf.filter(query_filter[1], formulas, match_on=MATCH_SUBSTRING)
-    return formulas
+    return helpers.filter_list(wf, 'cask_installed_casks', get_installed_casks, query)
 
 
 def filter_outdated_casks(wf, query):
-    formulas = wf.cached_data('cask_outdated_casks',
-                              get_outdated_casks,
-                              max_age=3600)
-    query_filter = query.split()
-    if len(query_filter) > 1:
-        return wf.filter(query_filter[1], formulas, match_on=MATCH_SUBSTRING)
-    return formulas
+    return helpers.filter_list(wf, 'cask_outdated_casks', get_outdated_casks, query)
 
 
 def main(wf):
@@ -89,10 +84,12 @@ def main(wf):
         # extract query
         query = wf.args[0] if len(wf.args) else None
 
+        # a new Alfred session has started, drop data of earlier ones
+        if not os.getenv('_WF_SESSION_ID'):
+            wf.clear_session_cache()
+
         if (not query and
-                len(wf.cached_data('cask_outdated_casks',
-                                   get_outdated_casks,
-                                   max_age=3600)) > 0):
+                len(helpers.get_cached(wf, 'cask_outdated_casks', get_outdated_casks)) > 0):
             wf.add_item('Some of your casks are outdated!',
                         autocomplete='outdated ',
                         valid=False,
@@ -143,9 +140,10 @@ def main(wf):
             actions = cask_actions.ACTIONS
             # filter actions by query
             if query:
-                actions = wf.filter(query, actions,
-                                    key=helpers.search_key_for_action,
-                                    match_on=MATCH_SUBSTRING)
+                with wf.span('filter'):
+                    actions = wf.filter(query, actions,
+                                        key=helpers.search_key_for_action,
+                                        match_on=MATCH_SUBSTRING)
 
             if len(actions) > 0:
                 for action in actions:
@@ -169,10 +167,17 @@ def main(wf):
     wf.send_feedback()
 
     # refresh cache
-    cmd = ['/usr/bin/env', 'python3', wf.workflowfile('cask_refresh.py')]
-    run_in_background('cask_refresh', cmd)
+    if helpers.refresh_due(wf):
+        with wf.span('background'):
+            run_in_background('refresh', helpers.refresh_command(wf))
+
+
+def create_workflow():
+    wf = AppWorkflow(update_settings={'github_slug': GITHUB_SLUG})
+    helpers.setup_cache(wf)
+    return wf
 
 
 if __name__ == '__main__':
-    wf = Workflow(update_settings={'github_slug': GITHUB_SLUG})
+    wf = create_workflow()
     sys.exit(wf.run(main))
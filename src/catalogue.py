@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Read the formula and cask catalogues from Homebrew's API cache.
+
+Since Homebrew 4, `brew` downloads all formulae and casks as JSON into
+`$HOMEBREW_CACHE/api`. Reading these files is much faster than spawning
+`brew formulae` or `brew casks`, which boot Ruby.
+"""
+
+import json
+import os
+
+API_FILES = {
+    'formula': ('formula.jws.json', 'formula.json'),
+    'cask': ('cask.jws.json', 'cask.json'),
+}
+
+
+def get_cache_dir():
+    """ Homebrew's cache directory, as reported by `brew --cache`. """
+    return os.environ.get('HOMEBREW_CACHE') or os.path.expanduser('~/Library/Caches/Homebrew')
+
+
+def api_file(kind):
+    """ Path to the API file of `kind` ('formula' or 'cask') or None if there is none. """
+    for filename in API_FILES[kind]:
+        path = os.path.join(get_cache_dir(), 'api', filename)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def load(path):
+    """ Parse an API file, either signed (`.jws.json`) or plain JSON. """
+    with open(path, 'rb') as fp:
+        data = json.load(fp)
+    # signed files wrap the JSON array as a string in `payload`
+    if isinstance(data, dict) and 'payload' in data:
+        data = json.loads(data['payload'])
+    return data
+
+
+def parse_formulae(data):
+    names = []
+    metadata = {}
+    for formula in data:
+        name = formula['name']
+        names.append(name)
+        metadata[name] = {
+            'version': (formula.get('versions') or {}).get('stable'),
+            'revision': formula.get('revision') or 0,
+            'version_scheme': formula.get('version_scheme') or 0,
+            'desc': formula.get('desc'),
+        }
+    return names, metadata
+
+
+def parse_casks(data):
+    names = []
+    metadata = {}
+    for cask in data:
+        token = cask['token']
+        names.append(token)
+        metadata[token] = {
+            'version': cask.get('version'),
+            'auto_updates': bool(cask.get('auto_updates')),
+            'desc': cask.get('desc'),
+        }
+    return names, metadata
+
+
+PARSERS = {
+    'formula': parse_formulae,
+    'cask': parse_casks,
+}
+
+
+def get_catalogue(wf, kind):
+    """
+    Names and metadata of all formulae or casks, or None if Homebrew has no API cache.
+    The parsed catalogue is cached and the API file is only read again once its mtime changes.
+    """
+    path = api_file(kind)
+    if path is None:
+        return None
+
+    mtime = os.stat(path).st_mtime
+    name = '%s_catalogue' % kind
+    catalogue = wf.cached_data(name, max_age=0)
+    if catalogue and catalogue['path'] == path and catalogue['mtime'] == mtime:
+        return catalogue
+
+    names, metadata = PARSERS[kind](load(path))
+    catalogue = {
+        'path': path,
+        'mtime': mtime,
+        'names': sorted(names),
+        'metadata': metadata,
+    }
+    wf.cache_data(name, catalogue)
+    return catalogue
+
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Read installed formulae and casks straight from the Homebrew prefix.
+
+`brew list` only lists directories, but boots Ruby to do so. Scanning
+`<prefix>/Cellar`, `<prefix>/Caskroom` and `<prefix>/var/homebrew/pinned`
+yields the same output in milliseconds. All functions return None if
+`prefix` has no Cellar, so callers can fall back to `brew`.
+
+The formulae and casks of third-party taps, which Homebrew's API files
+leave out, are listed from the taps' files in `Library/Taps`.
+
+The mtimes of these directories and of the taps' git refs also tell
+cheaply whether anything changed since a list was cached.
+"""
+
+import json
+import os
+import re
+
+
+def version_key(version):
+    """ Sort key for version strings, so that e.g. `1.10` sorts after `1.9`. """
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part)
+            for part in re.findall(r'\d+|[a-zA-Z]+', version)]
+
+
+def _subdirs(path):
+    """ Names of the non-hidden subdirectories of `path`, sorted. """
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return []
+    return sorted(e.name for e in entries
+                  if not e.name.startswith('.') and e.is_dir())
+
+
+def has_cellar(prefix):
+    return os.path.isdir(os.path.join(prefix, 'Cellar'))
+
+
+def installed_kegs(prefix):
+    """ Map of installed formula names to their installed versions (kegs). """
+    cellar = os.path.join(prefix, 'Cellar')
+    kegs = {}
+    for name in _subdirs(cellar):
+        versions = sorted(_subdirs(os.path.join(cellar, name)), key=version_key)
+        if versions:
+            kegs[name] = versions
+    return kegs
+
+
+def installed_formulae(prefix):
+    """ Lines of `brew list --versions`, e.g. `wget 1.21.3 1.21.4`. """
+    if not has_cellar(prefix):
+        return None
+    return [' '.join([name] + versions)
+            for name, versions in sorted(installed_kegs(prefix).items())]
+
+
+def pinned_kegs(prefix):
+    """ Map of pinned formula names to their pinned versions. """
+    pinned_dir = os.path.join(prefix, 'var', 'homebrew', 'pinned')
+    pinned = {}
+    try:
+        entries = list(os.scandir(pinned_dir))
+    except OSError:
+        return pinned
+    for entry in entries:
+        # symlinks to the pinned keg, e.g. `../../../Cellar/wget/1.21.4`
+        if entry.is_symlink():
+            pinned[entry.name] = os.path.basename(os.readlink(entry.path).rstrip('/'))
+    return pinned
+
+
+def pinned_formulae(prefix):
+    """ Lines of `brew list --pinned --versions`, e.g. `wget 1.21.4`. """
+    if not has_cellar(prefix):
+        return None
+    return ['%s %s' % item for item in sorted(pinned_kegs(prefix).items())]
+
+
+def installed_cask_versions(prefix):
+    """ Map of installed cask tokens to their installed versions. """
+    caskroom = os.path.join(prefix, 'Caskroom')
+    return {token: _subdirs(os.path.join(caskroom, token))
+            for token in _subdirs(caskroom)}
+
+
+def installed_casks(prefix):
+    """ Lines of `brew list --cask`, i.e. cask tokens. """
+    if not has_cellar(prefix):
+        return None
+    return sorted(installed_cask_versions(prefix))
+
+
+def pkg_version_key(pkg_version):
+    """ Sort key for keg names like `0.21_1`, i.e. version and revision. """
+    version, _, revision = pkg_version.partition('_')
+    return version_key(version), int(revision) if revision.isdigit() else 0
+
+
+def keg_version_scheme(keg):
+    """ `version_scheme` the keg was built with, as recorded in its install receipt. """
+    try:
+        with open(os.path.join(keg, 'INSTALL_RECEIPT.json'), 'rb') as fp:
+            receipt = json.load(fp)
+    except (OSError, ValueError):
+        return 0
+    return ((receipt.get('source') or {}).get('versions') or {}).get('version_scheme') or 0
+
+
+def outdated_formulae(prefix, metadata):
+    """
+    Lines of `brew outdated --formula --verbose`, e.g. `wget (1.21.3) < 1.21.4`,
+    computed from the Cellar and the catalogue `metadata`.
+    None if a formula is not in the catalogue (e.g. from a third-party tap), since
+    only `brew` knows whether it is outdated.
+    """
+    if not has_cellar(prefix):
+        return None
+    pinned = pinned_kegs(prefix)
+    lines = []
+    for name, versions in sorted(installed_kegs(prefix).items()):
+        latest = metadata.get(name)
+        if latest is None:
+            return None
+        if not latest['version']:
+            continue
+        kegs = [v for v in versions if not v.startswith('HEAD')]
+        if not kegs:
+            continue
+        latest_version = latest['version']
+        if latest['revision']:
+            latest_version += '_%d' % latest['revision']
+
+        newest = max(kegs, key=pkg_version_key)
+        scheme = keg_version_scheme(os.path.join(prefix, 'Cellar', name, newest))
+        if scheme > latest['version_scheme']:
+            continue
+        if (scheme == latest['version_scheme'] and
+                pkg_version_key(newest) >= pkg_version_key(latest_version)):
+            continue
+
+        line = '%s (%s) < %s' % (name, ', '.join(versions), latest_version)
+        if name in pinned:
+            line += ' [pinned at %s]' % pinned[name]
+        lines.append(line)
+    return lines
+
+
+def outdated_casks(prefix, metadata):
+    """
+    Lines of `brew outdated --cask --verbose`, e.g. `firefox (119.0) != 120.0`,
+    computed from the Caskroom and the catalogue `metadata`.
+    Like `brew outdated`, casks that update themselves or use `version :latest` are skipped.
+    None if a cask is not in the catalogue, like `outdated_formulae`.
+    """
+    if not has_cellar(prefix):
+        return None
+    lines = []
+    for token, versions in sorted(installed_cask_versions(prefix).items()):
+        latest = metadata.get(token)
+        if latest is None:
+            return None
+        if not latest['version'] or not versions:
+            continue
+        if latest['auto_updates'] or latest['version'] == 'latest':
+            continue
+        if latest['version'] in versions:
+            continue
+        lines.append('%s (%s) != %s' % (token, ', '.join(versions), latest['version']))
+    return lines
+
+
+def path_mtime(path):
+    """ mtime of `path` or None if it doesn't exist. """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def tree_mtime(path):
+    """
+    Latest mtime of `path` and its subdirectories, or None if `path` doesn't exist.
+    For the Cellar, it changes whenever a keg is added to or removed from any rack.
+    """
+    mtime = path_mtime(path)
+    if mtime is None:
+        return None
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return mtime
+    for entry in entries:
+        if not entry.name.startswith('.') and entry.is_dir():
+            mtime = max(mtime, entry.stat().st_mtime)
+    return mtime
+
+
+def taps_dir(prefix):
+    """ Directory of the installed taps, which is in `<prefix>/Homebrew` on Intel. """
+    for repository in (os.path.join(prefix, 'Homebrew'), prefix):
+        path = os.path.join(repository, 'Library', 'Taps')
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+# Taps whose formulae and casks are in Homebrew's API files
+CORE_TAPS = ('homebrew/homebrew-core', 'homebrew/homebrew-cask')
+
+
+def _tap_files(tap, kind):
+    """
+    Names of the formula or cask files in `tap`, looked up where `brew` does:
+    formulae in `Formula`, `HomebrewFormula` or the tap's root, casks in `Casks`.
+    """
+    if kind == 'cask':
+        dirs = [os.path.join(tap, 'Casks')]
+    else:
+        dirs = [os.path.join(tap, 'Formula'), os.path.join(tap, 'HomebrewFormula')]
+    for path in dirs:
+        if os.path.isdir(path):
+            # large taps shard their files into subdirectories, e.g. `Formula/w/wget.rb`
+            return [filename[:-3] for _, _, filenames in os.walk(path)
+                    for filename in filenames if filename.endswith('.rb')]
+    if kind == 'cask':
+        return []
+    try:
+        return [e.name[:-3] for e in os.scandir(tap) if e.name.endswith('.rb') and e.is_file()]
+    except OSError:
+        return []
+
+
+def tap_names(prefix, kind):
+    """
+    Full names of the formulae or casks (`kind`) of all taps but the core ones,
+    e.g. `user/repo/name` for `Library/Taps/user/homebrew-repo/Formula/name.rb`,
+    like `brew formulae` and `brew casks` list them.
+    """
+    taps = taps_dir(prefix)
+    if taps is None:
+        return []
+    names = []
+    for user in _subdirs(taps):
+        for repo in _subdirs(os.path.join(taps, user)):
+            if '%s/%s' % (user, repo) in CORE_TAPS:
+                continue
+            tap = '%s/%s' % (user, repo[9:] if repo.startswith('homebrew-') else repo)
+            names.extend('%s/%s' % (tap, name)
+                         for name in _tap_files(os.path.join(taps, user, repo), kind))
+    return sorted(names)
+
+
+def head_mtime(git_dir):
+    """ mtime of the ref checked out in `git_dir`, which changes with every fetched commit. """
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as fp:
+            head = fp.read().strip()
+    except OSError:
+        return None
+    if head.startswith('ref: '):
+        ref = os.path.join(git_dir, *head[5:].split('/'))
+        return path_mtime(ref) or path_mtime(os.path.join(git_dir, 'packed-refs'))
+    # detached HEAD
+    return path_mtime(os.path.join(git_dir, 'HEAD'))
+
+
+def tap_heads(prefix):
+    """ Names of all taps and the mtimes of their checked out refs. """
+    taps = taps_dir(prefix)
+    if taps is None:
+        return ()
+    return tuple(('%s/%s' % (user, repo), head_mtime(os.path.join(taps, user, repo, '.git')))
+                 for user in _subdirs(taps)
+                 for repo in _subdirs(os.path.join(taps, user)))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Entry point of the `brew` and `cask` script filters.
+
+If the query server is enabled (`query_server` in `HOMEBREW_OPTS`), the query
+is forwarded to it and its feedback printed. Otherwise, or if the server isn't
+running, the script filter runs in this process as before, which also starts
+the server for the following queries. Only the standard library is imported
+before the fallback, so forwarding a query is quick.
+
+Usage: client.py (brew|cask) QUERY
+"""
+
+import json
+import os
+import runpy
+import socket
+import stat
+import sys
+
+#: Seconds to wait for the server's feedback before running in-process
+TIMEOUT = 10
+
+SCRIPTS = ('brew', 'cask')
+
+
+def workflow_file(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+
+def socket_path():
+    """
+    Path of the server's Unix domain socket, which must be short, so it can't be in the
+    workflow's cache directory. Its directory must be private (see `is_private`).
+    """
+    tmpdir = os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(tmpdir, 'alfred-homebrew-%d' % os.getuid(), 'server.sock')
+
+
+def is_private(dirpath):
+    """ Whether only the current user can access the directory `dirpath`. """
+    try:
+        st = os.lstat(dirpath)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def recv_all(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def server_enabled():
+    """ Whether the query server is enabled in `settings.json`. """
+    datadir = os.environ.get('alfred_workflow_data')
+    if not datadir:
+        return False
+    try:
+        with open(os.path.join(datadir, 'settings.json'), 'rb') as fp:
+            settings = json.load(fp)
+    except (OSError, ValueError):
+        return False
+    return bool((settings.get('HOMEBREW_OPTS') or {}).get('query_server'))
+
+
+def query(script, args, path=None):
+    """
+    Send the query to the server. Returns its response, a dict with the feedback
+    (`output`) and exit status (`status`), or None if there is no server.
+    """
+    path = path or socket_path()
+    # the server of another user must not get the environment or answer the query
+    if not is_private(os.path.dirname(path)):
+        return None
+    request = {'script': script, 'args': args, 'env': dict(os.environ)}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(TIMEOUT)
+            conn.connect(path)
+            conn.sendall(json.dumps(request).encode('utf-8'))
+            conn.shutdown(socket.SHUT_WR)
+            response = recv_all(conn)
+    except OSError:
+        return None
+    try:
+        return json.loads(response.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def start_server():
+    from jobs import run_in_background
+    run_in_background('server', ['/usr/bin/env', 'python3', workflow_file('server.py')])
+
+
+def run_in_process(script, args):
+    """ Run the script filter like Alfred did before there was a server. """
+    sys.argv = [workflow_file('%s.py' % script)] + args
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+    except SystemExit as err:
+        return err.code
+    return 0
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in SCRIPTS:
+        sys.stderr.write(__doc__)
+        return 2
+    script, args = argv[1], argv[2:]
+
+    if not server_enabled():
+        return run_in_process(script, args)
+
+    response = query(script, args)
+    if response is not None:
+        sys.stdout.write(response['output'])
+        sys.stdout.flush()
+        return response['status']
+
+    status = run_in_process(script, args)
+    start_server()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
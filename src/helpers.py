@@ -2,7 +2,14 @@
 # encoding: utf-8
 
 import os
-import subprocess
+import time
+
+import catalogue
+import cellar
+from appworkflow import CACHE_STORES
+from jobs import run_in_background
+from search import Corpus
+from workflow import MATCH_ALLCHARS, MATCH_SUBSTRING
 
 BREW_INSTALL_URL = 'https://raw.githubusercontent.com/Homebrew/install/' \
                    'master/install'
@@ -18,12 +25,59 @@ BREW_VERSIONS = {
     }
 }
 
+# Maximum age in seconds of cached brew output that can't be validated
+CACHE_MAX_AGE = 3600
+
+# Cache serializer: lists of names are memory-mapped, so showing a few of them is
+# cheap however long the list is. Other data are pickled.
+CACHE_SERIALIZER = 'strtab'
+
+# Default cache store: `files` or `sqlite`
+CACHE_STORE = 'files'
+
+# Maximum number of formulae/casks shown by the script filters
+MAX_RESULTS = 200
+
+# Default minimum number of seconds between two background refreshes
+REFRESH_INTERVAL = 60
+
+# Cache key of the refresh coordinator's status record
+REFRESH_STATUS_KEY = 'refresh_status'
+
+# Lists kept up to date by the refresh coordinator and how old they may get
+# before they are due. All others are due once the refresh interval has passed.
+REFRESH_MAX_AGES = {
+    'brew_all_formulae': CACHE_MAX_AGE,
+    'brew_installed_formulae': None,
+    'brew_pinned_formulae': None,
+    'brew_outdated_formulae': None,
+    'cask_all_casks': CACHE_MAX_AGE,
+    'cask_installed_casks': None,
+    'cask_outdated_casks': None,
+}
+
+# What each cached list is derived from. As long as none of these changed,
+# a cached list is fresh no matter how old it is (see `get_validators`).
+VALIDATOR_SOURCES = {
+    'brew_all_formulae': ('formula_api', 'taps'),
+    'brew_installed_formulae': ('cellar',),
+    'brew_pinned_formulae': ('pinned',),
+    'brew_outdated_formulae': ('cellar', 'pinned', 'formula_api', 'taps'),
+    'cask_all_casks': ('cask_api', 'taps'),
+    'cask_installed_casks': ('caskroom',),
+    'cask_outdated_casks': ('caskroom', 'cask_api', 'taps'),
+}
+
 DEFAULT_SETTINGS = {
     'HOMEBREW_CASK_OPTS': {
         'appdir': '/Applications',
     },
     'HOMEBREW_OPTS': {
-        'current_brew': 'INTEL'
+        'current_brew': 'INTEL',
+        'fuzzy_search': False,
+        'refresh_interval': REFRESH_INTERVAL,
+        'cache_store': CACHE_STORE,
+        'query_server': False
     }
 }
 
@@ -42,6 +96,26 @@ def get_brew_arch(wf):
     return brew_arch
 
 
+def get_brew_prefix(wf):
+    """ Homebrew prefix of the selected brew, e.g. `/opt/homebrew`. """
+    if os.environ.get('HOMEBREW_PREFIX'):
+        return os.environ['HOMEBREW_PREFIX']
+    brew_file = BREW_VERSIONS[get_brew_arch(wf)]['FILE']
+    return os.path.dirname(os.path.dirname(brew_file))
+
+
+def setup_cache(wf):
+    """ Configure how the script filters and the refresh coordinator cache their data. """
+    opts = wf.settings.get('HOMEBREW_OPTS', None) or {}
+    wf.cache_serializer = CACHE_SERIALIZER
+    store = opts.get('cache_store', CACHE_STORE)
+    # called before `wf.run`, which would show an error, so a typo mustn't raise
+    if store not in CACHE_STORES:
+        wf.logger.warning('unknown cache store %r in settings, using %r', store, CACHE_STORE)
+        store = CACHE_STORE
+    wf.cache_store = store
+
+
 def initialise_path(brew_arch):
     """
     Configure the environment for ARM brew if ARM brew is installed.
@@ -64,6 +138,7 @@ def edit_settings(wf):
         for key in DEFAULT_SETTINGS:
             wf.settings[key] = DEFAULT_SETTINGS[key]
     # Edit settings
+    import subprocess
     subprocess.call(['open', wf.settings_path])
 
 
@@ -105,3 +180,184 @@ def search_key_for_action(action):
     elements.append(action['name'])
     elements.append(action['description'])
     return u' '.join(elements)
+
+
+def corpus_name(name):
+    """ Cache key of the search corpus prepared for the cached list `name`. """
+    return '%s_corpus' % name
+
+
+def get_validators(wf, names):
+    """
+    Validators of the cached lists `names`, i.e. the mtimes of everything they are derived
+    from, or None for lists that can't be validated, e.g. because they are fetched with `brew`.
+    """
+    prefix = get_brew_prefix(wf)
+    if not cellar.has_cellar(prefix):
+        return dict.fromkeys(names)
+
+    def api_mtime(kind):
+        path = catalogue.api_file(kind)
+        return cellar.path_mtime(path) if path else None
+
+    homebrew_var = os.path.join(prefix, 'var', 'homebrew')
+    sources = {
+        # `opt` links are replaced on every install, upgrade and uninstall
+        'cellar': lambda: (cellar.tree_mtime(os.path.join(prefix, 'Cellar')),
+                           cellar.path_mtime(os.path.join(prefix, 'opt'))),
+        'pinned': lambda: (cellar.path_mtime(homebrew_var),
+                           cellar.path_mtime(os.path.join(homebrew_var, 'pinned'))),
+        'caskroom': lambda: (cellar.path_mtime(prefix),
+                             cellar.tree_mtime(os.path.join(prefix, 'Caskroom'))),
+        'formula_api': lambda: api_mtime('formula'),
+        'cask_api': lambda: api_mtime('cask'),
+        'taps': lambda: cellar.tap_heads(prefix),
+    }
+    values = {}
+    validators = {}
+    for name in names:
+        if name not in VALIDATOR_SOURCES:
+            validators[name] = None
+            continue
+        for source in VALIDATOR_SOURCES[name]:
+            if source not in values:
+                values[source] = sources[source]()
+        validator = tuple(values[source] for source in VALIDATOR_SOURCES[name])
+        validators[name] = validator if None not in validator else None
+    return validators
+
+
+def get_validator(wf, name):
+    return get_validators(wf, [name])[name]
+
+
+def due_lists(wf, status):
+    """
+    Those of the lists kept up to date by the refresh coordinator that are missing,
+    invalid or (if they can't be validated) older than their maximum age, given
+    the coordinator's `status` record.
+    """
+    now = time.time()
+    interval = get_refresh_interval(wf)
+    updated = status['keys'] if status else {}
+    validators = get_validators(wf, REFRESH_MAX_AGES)
+    due = set()
+    for key, max_age in REFRESH_MAX_AGES.items():
+        if key not in updated:
+            due.add(key)
+        elif validators[key] is not None:
+            if not wf.cached_data_valid(key, validators[key]):
+                due.add(key)
+        elif now - updated[key]['updated'] >= (max_age or interval):
+            due.add(key)
+    return due
+
+
+def cache_list(wf, name, data, validator=None):
+    """ Cache a list together with its search corpus (`None` deletes both). """
+    cache_lists(wf, {name: data}, {name: validator})
+
+
+def cache_lists(wf, lists, validators):
+    """
+    Cache the lists `lists` maps cache keys to, and their search corpora, all at once.
+    The corpora are built before the cache store is locked, which only the writes need.
+    """
+    corpora = {name: Corpus(data) if data is not None else None for name, data in lists.items()}
+    with wf.cache_transaction():
+        for name, data in lists.items():
+            wf.cache_data(name, data, validator=validators.get(name))
+            wf.cache_data(corpus_name(name), corpora[name], validator=validators.get(name))
+
+
+def refresh_command(wf, *keys):
+    """ Command to refresh the cached lists `keys` (all that are due if none are given). """
+    return ['/usr/bin/env', 'python3', wf.workflowfile('refresh.py')] + list(keys)
+
+
+def traced(wf, name, data_func):
+    """ `data_func` recording cache key `name` with the `brew` commands it runs. """
+    def fetch():
+        with wf.command_tracer.cache_key(name):
+            return data_func()
+
+    return fetch
+
+
+def get_cached(wf, name, data_func, refresh_key=None):
+    """
+    Cached data of `name`. Stale data are returned immediately and `refresh_key` is
+    refreshed in the background, while Alfred re-runs the script filter to pick it up.
+    """
+    key = refresh_key or name
+    failed = []
+
+    def refresh():
+        # retried once the refresh interval has passed, without re-running until then
+        if refresh_failed(wf, key):
+            wf.logger.debug('last refresh of %s failed, not retrying yet', key)
+            failed.append(key)
+            return
+        with wf.span('background'):
+            run_in_background('refresh', refresh_command(wf, key))
+
+    data, stale = wf.cached_data_or_stale(name, traced(wf, name, data_func),
+                                          max_age=CACHE_MAX_AGE,
+                                          refresh=refresh,
+                                          validator=get_validator(wf, key))
+    if stale and not failed:
+        wf.rerun = 1
+    return data
+
+
+def refresh_failed(wf, name):
+    """ Whether the last refresh of the cached list `name` failed less than a refresh interval ago. """
+    status = wf.cached_data(REFRESH_STATUS_KEY, max_age=0) or {}
+    failed = status.get('failed', {}).get(name)
+    return failed is not None and time.time() - failed < get_refresh_interval(wf)
+
+
+def get_corpus(wf, name, data_func):
+    def build():
+        return Corpus(get_cached(wf, name, data_func))
+
+    return get_cached(wf, corpus_name(name), build, refresh_key=name)
+
+
+def get_match_on(wf):
+    """ Match rules for filtering lists, fuzzy if enabled in the settings. """
+    opts = wf.settings.get('HOMEBREW_OPTS', None) or {}
+    if opts.get('fuzzy_search'):
+        return MATCH_SUBSTRING | MATCH_ALLCHARS
+    return MATCH_SUBSTRING
+
+
+def filter_list(wf, name, data_func, query):
+    """ Filter the cached list `name` by the second word of `query`. """
+    query_filter = query.split()
+    with wf.span('filter'):
+        if len(query_filter) > 1:
+            return wf.filter_corpus(query_filter[1],
+                                    get_corpus(wf, name, data_func),
+                                    max_results=MAX_RESULTS,
+                                    match_on=get_match_on(wf),
+                                    narrow='%s_matches' % name)
+        return get_cached(wf, name, data_func)[:MAX_RESULTS]
+
+
+def get_refresh_interval(wf):
+    opts = wf.settings.get('HOMEBREW_OPTS', None) or {}
+    return opts.get('refresh_interval', REFRESH_INTERVAL)
+
+
+def refresh_due(wf):
+    """
+    Whether any cached list is missing, invalid or (if it can't be validated)
+    old enough to be refreshed in the background.
+    """
+    status = wf.cached_data(REFRESH_STATUS_KEY, max_age=0)
+    if not status or not status['last_run']:
+        return True
+    if time.time() - status['last_run'] < get_refresh_interval(wf):
+        return False
+    return bool(due_lists(wf, status))
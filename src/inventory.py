@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Derive all installed, pinned and outdated lists from one `brew info` call.
+
+Used by the refresh scripts when the lists can't be computed locally from
+the Homebrew prefix and API cache (see `cellar` and `catalogue`).
+"""
+
+import json
+
+import brew
+import catalogue
+import cellar
+import helpers
+
+#: Cache keys populated from the inventory
+KEYS = (
+    'brew_installed_formulae',
+    'brew_pinned_formulae',
+    'brew_outdated_formulae',
+    'cask_installed_casks',
+    'cask_outdated_casks',
+)
+
+
+def is_needed(wf):
+    """ Whether the lists can't be computed from the prefix and API cache alone. """
+    return (not cellar.has_cellar(helpers.get_brew_prefix(wf)) or
+            catalogue.api_file('formula') is None or
+            catalogue.api_file('cask') is None)
+
+
+def parse_inventory(data):
+    """ Map the output of `brew info --json=v2 --installed` to the lists of `KEYS`. """
+    lists = {key: [] for key in KEYS}
+
+    for formula in sorted(data.get('formulae', []), key=lambda f: f['name']):
+        name = formula['name']
+        versions = [keg['version'] for keg in formula.get('installed', [])]
+        if not versions:
+            continue
+        lists['brew_installed_formulae'].append(' '.join([name] + versions))
+        if formula.get('pinned'):
+            version = formula.get('linked_keg') or versions[-1]
+            lists['brew_pinned_formulae'].append('%s %s' % (name, version))
+        if formula.get('outdated'):
+            latest = (formula.get('versions') or {}).get('stable') or ''
+            if formula.get('revision'):
+                latest += '_%d' % formula['revision']
+            lists['brew_outdated_formulae'].append(
+                '%s (%s) < %s' % (name, ', '.join(versions), latest))
+
+    for cask in sorted(data.get('casks', []), key=lambda c: c['token']):
+        token = cask['token']
+        if not cask.get('installed'):
+            continue
+        lists['cask_installed_casks'].append(token)
+        if cask.get('outdated'):
+            lists['cask_outdated_casks'].append(
+                '%s (%s) != %s' % (token, cask['installed'], cask.get('version')))
+
+    return lists
+
+
+def get_inventory(wf):
+    """ Installed, pinned and outdated formulae and casks from a single `brew` spawn. """
+    output = brew.execute(wf, ['brew', 'info', '--json=v2', '--installed'])
+    try:
+        data = json.loads(output)
+    except ValueError:
+        raise ValueError('unexpected output of `brew info`: %s' % output[:200])
+    return parse_inventory(data)
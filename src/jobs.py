@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Run commands in background jobs forked from the calling process.
+
+`workflow.background.run_in_background` starts a new Python process, which
+daemonizes and runs the command. Starting that process takes longer than
+everything else a script filter does. `run_in_background` here forks the
+calling process instead. Jobs use the library's PID files, so
+`workflow.background.is_running` and `kill` work for them as well.
+"""
+
+import logging
+import os
+
+
+def _background():
+    """ `workflow.background`, which imports `subprocess` and is only needed to start a job. """
+    from workflow import background
+    return background
+
+
+def _write_pid(pidfile, pid):
+    """ Atomically write `pid` to `pidfile`. """
+    tmp = '%s.%d.tmp' % (pidfile, os.getpid())
+    with open(tmp, 'w') as fp:
+        fp.write(str(pid))
+    os.rename(tmp, pidfile)
+
+
+def _run_job(name, args, kwargs, pidfile):  # pragma: no cover
+    """ Run job `name` in the daemon process and delete its PID file. """
+    import subprocess
+
+    log = _background().wf().logger
+    try:
+        log.debug('[%s] running command: %r', name, args)
+        retcode = subprocess.call(args, **kwargs)
+        if retcode:
+            log.error('[%s] command failed with status %d', name, retcode)
+    finally:
+        if os.path.exists(pidfile):
+            os.unlink(pidfile)
+
+    log.debug('[%s] job complete', name)
+
+
+def _spawn(name, args, kwargs):
+    """
+    Run job `name` in a daemon forked from the current process.
+
+    The current process forks, the child starts a new session and forks
+    the daemon, writes its PID to the PID file and exits. The daemon runs
+    the command and never returns to the caller.
+    Returns the exit status of the first child, i.e. 0 if the daemon was
+    started and its PID file written.
+    """
+    background = _background()
+    pidfile = background._pid_file(name)
+    log = background.wf().logger
+    workflowdir = background.wf().workflowdir
+
+    pid = os.fork()
+    if pid > 0:  # wait for first child, which exits right away
+        _, status = os.waitpid(pid, 0)
+        return os.waitstatus_to_exitcode(status)
+
+    # First child. Only `os._exit()` from here on: the caller's buffered
+    # output and exit handlers belong to the caller.
+    try:  # pragma: no cover
+        os.setsid()
+        pid = os.fork()
+        if pid > 0:
+            _write_pid(pidfile, pid)
+            os._exit(0)
+    except BaseException as err:  # pragma: no cover
+        log.critical('[%s] failed to start background job: %s', name, err)
+        os._exit(1)
+
+    # Now I am a daemon!
+    try:  # pragma: no cover
+        os.chdir(workflowdir)
+        # Redirect standard file descriptors.
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        # Close all other descriptors inherited from the caller, e.g. the
+        # query server's sockets, whose clients would otherwise wait for
+        # the job to finish. Log files are opened again when written to.
+        for handler in logging.getLogger('').handlers:
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+        os.closerange(3, os.sysconf('SC_OPEN_MAX'))
+        _run_job(name, args, kwargs, pidfile)
+    except BaseException as err:  # pragma: no cover
+        log.exception('[%s] background job failed: %s', name, err)
+    finally:  # pragma: no cover
+        os._exit(0)
+
+
+def run_in_background(name, args, **kwargs):
+    """
+    Run `args` via `subprocess.call` in a background job, like
+    `workflow.background.run_in_background` does.
+
+    Returns as soon as the daemon's PID has been written to the job's PID
+    file, i.e. `is_running` is True right away: 0 if the job was started,
+    else a non-zero exit code, or None if a job `name` is running already.
+    """
+    background = _background()
+    log = background.wf().logger
+    if background.is_running(name):
+        log.info('[%s] job already running', name)
+        return None
+
+    retcode = _spawn(name, args, kwargs)
+
+    if retcode:  # pragma: no cover
+        log.error('[%s] failed to start background job: %d', name, retcode)
+    else:
+        log.debug('[%s] background job started', name)
+
+    return retcode
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Refresh coordinator shared by the `brew` and `cask` script filters.
+
+It owns the cached lists of both script filters and fetches them concurrently.
+Both script filters start it as the same background job, so only one refresh
+runs at a time, and a lock on the Homebrew prefix keeps refreshes apart that
+were started otherwise. What it did is recorded under `STATUS_KEY`.
+"""
+
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import brew
+import cask
+import catalogue
+import helpers
+import inventory
+from appworkflow import AppWorkflow
+from workflow.util import LockFile
+
+#: Name of the background job
+JOB_NAME = 'refresh'
+
+#: Cache key of the status record
+STATUS_KEY = helpers.REFRESH_STATUS_KEY
+
+
+def timed(func):
+    """ Call `func` and return its result and duration. """
+    start = time.time()
+    data = func()
+    return data, time.time() - start
+
+
+def get_jobs(wf, keys=None):
+    """ Jobs for all lists that are due (or for `keys` only), without duplicates. """
+    brew.wf = wf
+    cask.wf = wf
+    if keys:
+        keys = set(keys)
+    else:
+        keys = helpers.due_lists(wf, wf.cached_data(STATUS_KEY, max_age=0))
+
+    # parsed here once for both lists derived from a catalogue, not in each job's thread
+    formulae = casks = None
+    if keys & {'brew_all_formulae', 'brew_outdated_formulae'}:
+        formulae = catalogue.get_catalogue(wf, 'formula')
+    if keys & {'cask_all_casks', 'cask_outdated_casks'}:
+        casks = catalogue.get_catalogue(wf, 'cask')
+
+    if inventory.is_needed(wf):
+        # one `brew info` call for the lists of both script filters
+        jobs = {inventory.KEYS: lambda: inventory.get_inventory(wf)}
+    else:
+        jobs = {
+            'brew_installed_formulae': brew.get_installed_formulae,
+            'brew_pinned_formulae': brew.get_pinned_formulae,
+            'brew_outdated_formulae': lambda: brew.get_outdated_formulae(formulae),
+            'cask_installed_casks': cask.get_installed_casks,
+            'cask_outdated_casks': lambda: cask.get_outdated_casks(casks),
+        }
+    jobs['brew_all_formulae'] = lambda: brew.get_all_formulae(formulae)
+    jobs['cask_all_casks'] = lambda: cask.get_all_casks(casks)
+    return {job: func for job, func in jobs.items() if set(job_keys(job)) & keys}
+
+
+def job_keys(job):
+    """ Cache keys of the lists fetched by `job`. """
+    return job if isinstance(job, tuple) else (job,)
+
+
+def run(wf, jobs):
+    """
+    Run `jobs`, a dict mapping cache keys to functions that fetch their lists, concurrently.
+    A job may also fetch several lists at once: its key is then a tuple of cache keys and
+    its function returns a dict of cache keys and lists.
+    Every list is cached as soon as its job has finished, all lists of a job at once.
+    Returns the duration of the job of every refreshed list, None for lists whose job failed.
+    """
+    timings = {}
+    # captured before fetching, so changes made meanwhile invalidate the lists
+    validators = helpers.get_validators(wf, [key for job in jobs for key in job_keys(job)])
+    with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as executor:
+        futures = {executor.submit(timed, helpers.traced(wf, ','.join(job_keys(key)), func)): key
+                   for key, func in jobs.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                data, duration = future.result()
+            except Exception as err:
+                wf.logger.exception('[%s] failed to refresh %s: %s', JOB_NAME, key, err)
+                timings.update(dict.fromkeys(job_keys(key)))
+                continue
+            if not isinstance(key, tuple):
+                data = {key: data}
+            # lists fetched together are replaced together
+            helpers.cache_lists(wf, data, validators)
+            timings.update(dict.fromkeys(data, duration))
+            wf.logger.debug('[%s] refreshed %s in %0.3fs', JOB_NAME, key, duration)
+    return timings
+
+
+def get_status(wf):
+    """
+    Status record of the last refresh: its start time (`last_run`), its `duration`,
+    for every cache key, when it was last refreshed and how long that took (`keys`),
+    and for every cache key whose last refresh failed, when that was (`failed`).
+    """
+    status = wf.cached_data(STATUS_KEY, max_age=0) or {
+        'last_run': None,
+        'duration': None,
+        'keys': {},
+    }
+    status.setdefault('failed', {})
+    return status
+
+
+def update_status(wf, start, timings):
+    status = get_status(wf)
+    status['last_run'] = start
+    status['duration'] = time.time() - start
+    for key, duration in timings.items():
+        if duration is None:
+            status['failed'][key] = time.time()
+        else:
+            status['keys'][key] = {'updated': time.time(), 'duration': duration}
+            status['failed'].pop(key, None)
+    wf.cache_data(STATUS_KEY, status)
+    return status
+
+
+def refresh(wf):
+    """
+    Refresh all lists that are due, or the lists passed as arguments,
+    unless another refresh holds the prefix lock.
+    """
+    prefix = helpers.get_brew_prefix(wf)
+    lock = LockFile(wf.cachefile('refresh-%s' % re.sub(r'\W+', '-', prefix).strip('-')))
+    if not lock.acquire(blocking=False):
+        wf.logger.info('[%s] %s is being refreshed already', JOB_NAME, prefix)
+        return None
+    try:
+        start = time.time()
+        timings = run(wf, get_jobs(wf, wf.args))
+        status = update_status(wf, start, timings)
+    finally:
+        lock.release()
+    wf.logger.debug('[%s] finished in %0.3fs', JOB_NAME, status['duration'])
+    return status
+
+
+if __name__ == '__main__':
+    wf = AppWorkflow()
+    helpers.setup_cache(wf)
+    sys.exit(wf.run(refresh))
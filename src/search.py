@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Prepared search corpora for `AppWorkflow.filter_corpus`.
+
+`Workflow.filter` derives its comparison keys (lower-cased and
+ASCII-folded values, "atoms", initials, character sets) from every item
+on every call. A `Corpus` does that work once, so it can be cached
+alongside the list it was built from and re-used on every keystroke.
+
+Results are identical to those of `Workflow.filter` called with the
+same arguments.
+"""
+
+import heapq
+import unicodedata
+from array import array
+from bisect import bisect_left
+from itertools import compress
+
+from workflow.workflow import (ASCII_REPLACEMENTS, INITIALS, MATCH_ALL,
+                               MATCH_ALLCHARS, MATCH_ATOM, MATCH_CAPITALS,
+                               MATCH_INITIALS_CONTAIN,
+                               MATCH_INITIALS_STARTSWITH, MATCH_STARTSWITH,
+                               MATCH_SUBSTRING, isascii, split_on_delimiters)
+
+__all__ = ['Corpus', 'narrows', 'rank', 'subsequence_end']
+
+#: Length of the n-grams in a :class:`Corpus`'s substring index
+NGRAM_SIZE = 3
+
+#: Rules that only match if the query is a substring of the search key,
+#: and can therefore be answered from the n-gram index
+SUBSTRING_RULES = MATCH_STARTSWITH | MATCH_ATOM | MATCH_SUBSTRING
+
+
+def subsequence_end(text, query):
+    """Find the end of the shortest prefix of ``text`` containing ``query``.
+
+    Used to score :const:`MATCH_ALLCHARS` matches: all characters of
+    ``query`` must appear in ``text`` in the same order. The leftmost
+    occurrence of each character is taken, which gives the same span as
+    the lazy ``.*?a.*?b…`` regex of :meth:`Workflow.filter`, without its
+    backtracking.
+
+    :param text: lower-case text to search
+    :type text: ``str``
+    :param query: lower-case characters to find
+    :type query: ``str``
+    :returns: index after the last matched character or ``0`` if
+        ``text`` doesn't contain ``query``
+    :rtype: ``int``
+
+    """
+    end = 0
+    find = text.find
+    for c in query:
+        end = find(c, end) + 1
+        if not end:
+            return 0
+    return end
+
+
+def rank(results, ascending=False, include_score=False, min_score=0,
+         max_results=0):
+    """Sort and prune scored results like :meth:`Workflow.filter`.
+
+    If only the best ``max_results`` are wanted, they are selected with
+    a heap in O(n log k) instead of sorting all results.
+
+    :param results: list of ``((sort key), (item, score, rule))``
+        tuples, e.g. from :meth:`Corpus.results`
+    :returns: list of items or ``(item, score, rule)`` tuples
+
+    All other arguments are the same as for :meth:`Workflow.filter`.
+
+    """
+    if min_score:
+        results = [r for r in results if r[1][1] > min_score]
+
+    # sort on keys, then discard the keys
+    if max_results and len(results) > max_results:
+        if ascending:
+            results = heapq.nlargest(max_results, results)
+        else:
+            results = heapq.nsmallest(max_results, results)
+    else:
+        results.sort(reverse=ascending)
+    results = [t[1] for t in results]
+
+    # return list of ``(item, score, rule)``
+    if include_score:
+        return results
+
+    # just return list of items
+    return [t[0] for t in results]
+
+
+def _fold(text):
+    """Fold ``text`` to ASCII like :meth:`Workflow.fold_to_ascii`."""
+    if isascii(text):
+        return text
+    text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
+    return unicodedata.normalize('NFKD', text)
+
+
+def narrows(previous, query, match_on):
+    """Whether all matches of ``query`` are also matches of ``previous``.
+
+    This is the case if ``query`` extends ``previous`` (e.g. ``pytho``
+    extends ``pyth``), the words of both queries fold to ASCII the same
+    way, and ``match_on`` doesn't rely on :const:`MATCH_ATOM` alone,
+    the only rule that can match a longer query but not a shorter one.
+
+    :param previous: earlier query
+    :type previous: ``str``
+    :param query: new query
+    :type query: ``str``
+    :param match_on: Filter option flags
+    :type match_on: ``int``
+    :returns: ``True`` if only the matches of ``previous`` need testing
+    :rtype: ``Boolean``
+
+    """
+    if not query.startswith(previous):
+        return False
+
+    if (match_on & MATCH_ATOM and
+            not match_on & (MATCH_SUBSTRING | MATCH_ALLCHARS)):
+        return False
+
+    old = [w for w in previous.split(' ') if w.strip()]
+    new = [w for w in query.split(' ') if w.strip()]
+    return all(isascii(a) == isascii(b) for a, b in zip(old, new))
+
+
+def charmask(text):
+    """Return 64-bit mask of the characters in lower-case ``text``.
+
+    ``a-z`` and ``0-9`` have a bit each, all other characters share
+    the remaining 28 bits.
+
+    :param text: lower-case text
+    :type text: ``str``
+    :returns: bitmask
+    :rtype: ``int``
+
+    """
+    mask = 0
+    for c in set(text):
+        if 'a' <= c <= 'z':
+            mask |= 1 << (ord(c) - 97)
+        elif '0' <= c <= '9':
+            mask |= 1 << (ord(c) - 22)
+        else:
+            mask |= 1 << (36 + ord(c) % 28)
+    return mask
+
+
+def _ngrams(text):
+    """Return the set of :const:`NGRAM_SIZE`-grams in ``text``."""
+    return {text[i:i + NGRAM_SIZE]
+            for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class _View(object):
+    """Pre-computed comparison keys for one form (raw or folded) of the keys.
+
+    Every attribute is a sequence with one entry per item of the corpus.
+    Items with an empty search key have ``None`` in :attr:`lower`.
+
+    """
+
+    def __init__(self, values):
+        self.lower = []
+        self.lengths = []
+        #: Character-presence bitmasks (see :func:`charmask`)
+        self.masks = array('Q')
+        self.capitals = []
+        self.atoms = []
+        self.initials = []
+
+        for value in values:
+            if value is None:
+                self.lower.append(None)
+                self.lengths.append(0)
+                self.masks.append(0)
+                self.capitals.append(None)
+                self.atoms.append(None)
+                self.initials.append(None)
+                continue
+
+            lower = value.lower()
+            atoms = tuple(s.lower() for s in split_on_delimiters(value))
+            self.lower.append(lower)
+            self.lengths.append(len(value))
+            self.masks.append(charmask(lower))
+            self.capitals.append(
+                ''.join([c for c in value if c in INITIALS]).lower())
+            self.atoms.append(atoms)
+            self.initials.append(''.join([s[0] for s in atoms if s]))
+
+    def prefilter(self, mask, candidates):
+        """Return the candidates whose bitmask contains all bits of ``mask``.
+
+        Replaces the ``set(query) <= set(value)`` test of
+        :meth:`Workflow._filter_item`. Every matching rule implies that
+        test, so a (rare) false positive due to two characters sharing
+        a bit only means an item is scored for nothing.
+
+        :param mask: bitmask of the query (see :func:`charmask`)
+        :type mask: ``int``
+        :param candidates: indices of items to test or ``None`` for all
+        :returns: list of indices
+
+        """
+        masks = self.masks
+        if candidates is None:
+            # whole corpus: iterate in C via `map`/`compress`
+            return list(compress(range(len(masks)),
+                                 map(mask.__eq__, map(mask.__and__, masks))))
+
+        return [i for i in candidates if masks[i] & mask == mask]
+
+    def score(self, i, query, match_on):
+        """Score item ``i`` against lower-case ``query``.
+
+        Mirrors :meth:`Workflow._filter_item`, except that its character
+        pre-filter has already been applied by :meth:`prefilter`.
+
+        :returns: ``(score, rule)``
+
+        """
+        lower = self.lower[i]
+
+        if match_on & MATCH_STARTSWITH and lower.startswith(query):
+            return (100.0 - (self.lengths[i] / len(query)), MATCH_STARTSWITH)
+
+        if match_on & MATCH_CAPITALS:
+            capitals = self.capitals[i]
+            if capitals.startswith(query):
+                return (100.0 - (len(capitals) / len(query)), MATCH_CAPITALS)
+
+        if match_on & MATCH_ATOM and query in self.atoms[i]:
+            return (100.0 - (self.lengths[i] / len(query)), MATCH_ATOM)
+
+        initials = self.initials[i]
+        if (match_on & MATCH_INITIALS_STARTSWITH and
+                initials.startswith(query)):
+            return (100.0 - (len(initials) / len(query)),
+                    MATCH_INITIALS_STARTSWITH)
+
+        elif match_on & MATCH_INITIALS_CONTAIN and query in initials:
+            return (95.0 - (len(initials) / len(query)),
+                    MATCH_INITIALS_CONTAIN)
+
+        if match_on & MATCH_SUBSTRING and query in lower:
+            return (90.0 - (self.lengths[i] / len(query)), MATCH_SUBSTRING)
+
+        if match_on & MATCH_ALLCHARS:
+            end = subsequence_end(lower, query)
+            if end:
+                return (100.0 / (end + 1), MATCH_ALLCHARS)
+
+        return (0, None)
+
+
+class Corpus(object):
+    """A list of items with pre-computed search keys.
+
+    Build a corpus when the data are fetched, cache it (it pickles
+    cleanly) and pass it to :meth:`AppWorkflow.filter_corpus` instead of
+    calling :meth:`Workflow.filter` on the raw list.
+
+    :param items: items to search
+    :type items: ``list`` or ``tuple``
+    :param key: function to get comparison key from ``items``.
+        Must return a ``str`` string. The default simply returns
+        the item.
+    :type key: ``callable``
+
+    Attributes:
+        items (list): The items the corpus was built from.
+        checksum (str): Fingerprint of the search keys.
+
+    """
+
+    def __init__(self, items, key=lambda x: x):
+        """Create new :class:`Corpus`."""
+        self.items = list(items)
+
+        values = []
+        for item in self.items:
+            value = key(item).strip()
+            values.append(value or None)
+
+        #: Sort keys, as used by :meth:`Workflow.filter`
+        self.sort_keys = [v.lower() if v else None for v in values]
+        self.values = values
+        # Two corpora with the same checksum have the same keys at the
+        # same indices
+        import hashlib
+        self.checksum = hashlib.sha1(
+            '\0'.join([v or '' for v in values]).encode('utf-8')).hexdigest()
+
+        folded = [_fold(v) if v else None for v in values]
+        self._folded = _View(folded)
+        # Only keep a separate unfolded view if folding changed anything
+        if folded == values:
+            self._raw = self._folded
+        else:
+            self._raw = _View(values)
+
+        # Posting lists of the indices of all items containing each
+        # n-gram of their lower-case, folded search key. They are stored
+        # as flat arrays (the posting list of ``_ngrams[n]`` is
+        # ``_postings[_offsets[n]:_offsets[n + 1]]``), which unpickle
+        # much faster than a dict of lists.
+        postings = {}
+        for i, lower in enumerate(self._folded.lower):
+            if lower is None:
+                continue
+            for ngram in _ngrams(lower):
+                postings.setdefault(ngram, []).append(i)
+        self._ngrams = sorted(postings)
+        self._offsets = array('I', [0])
+        self._postings = array('I')
+        for ngram in self._ngrams:
+            self._postings.extend(postings[ngram])
+            self._offsets.append(len(self._postings))
+
+    def __len__(self):
+        """Number of items in corpus."""
+        return len(self.items)
+
+    def search(self, query, match_on=MATCH_ALL, fold_diacritics=True):
+        """Score all items against ``query``.
+
+        :param query: query to test items against. Must not be empty.
+        :type query: ``str``
+        :param match_on: Filter option flags. Bitwise-combined list of
+            ``MATCH_*`` constants.
+        :type match_on: ``int``
+        :param fold_diacritics: Fold search keys to ASCII if a query word
+            only contains ASCII characters.
+        :type fold_diacritics: ``Boolean``
+        :returns: unsorted list of ``((sort key), (item, score, rule))``
+            tuples as used by :meth:`Workflow.filter`.
+        :rtype: ``list``
+
+        """
+        return self.results(self.match(query, match_on, fold_diacritics))
+
+    def match(self, query, match_on=MATCH_ALL, fold_diacritics=True,
+              candidates=None):
+        """Find the items matching ``query``.
+
+        :param query: query to test items against. Must not be empty.
+        :type query: ``str``
+        :param match_on: Filter option flags.
+        :type match_on: ``int``
+        :param fold_diacritics: Fold search keys to ASCII if a query word
+            only contains ASCII characters.
+        :type fold_diacritics: ``Boolean``
+        :param candidates: If set, only test the items with these indices,
+            e.g. the matches of a query that ``query`` extends.
+        :type candidates: iterable of ``int``
+        :returns: list of ``(index, score, rule)`` tuples
+        :rtype: ``list``
+
+        """
+        words = []
+        for word in query.split(' '):
+            word = word.strip().lower()
+            if not word:
+                continue
+            if fold_diacritics and isascii(word):
+                words.append((word, self._folded))
+            else:
+                words.append((word, self._raw))
+
+        if candidates is None:
+            candidates = self._candidates(words, match_on)
+
+        # pre-filter any items that do not contain all characters
+        # of ``query`` to save on running several more expensive tests
+        views = {id(view): view for _, view in words}
+        for view in views.values():
+            mask = 0
+            for word, v in words:
+                if v is view:
+                    mask |= charmask(word)
+            candidates = view.prefilter(mask, candidates)
+
+        if candidates is None:
+            candidates = range(len(self.items))
+
+        matches = []
+        for i in candidates:
+            if self.values[i] is None:
+                continue
+
+            score = 0
+            for word, view in words:
+                s, rule = view.score(i, word, match_on)
+                if not s:  # Skip items that don't match part of the query
+                    break
+                score += s
+            else:
+                if score:
+                    matches.append((i, score, rule))
+
+        return matches
+
+    def results(self, matches):
+        """Convert the output of :meth:`match` for :func:`rank`.
+
+        :param matches: list of ``(index, score, rule)`` tuples
+        :returns: list of ``((sort key), (item, score, rule))`` tuples
+        :rtype: ``list``
+
+        """
+        return [((100.0 / score, self.sort_keys[i], score),
+                 (self.items[i], score, rule))
+                for i, score, rule in matches]
+
+    def _candidates(self, words, match_on):
+        """Indices of the items that may match all ``words``.
+
+        If ``match_on`` only contains rules that require the query to be
+        a substring of the search key, the posting lists of the n-grams of
+        every (folded) query word are intersected. Otherwise, or if all
+        words are shorter than :const:`NGRAM_SIZE`, all items are
+        candidates.
+
+        :param words: list of ``(word, view)`` tuples
+        :param match_on: Filter option flags
+        :returns: list of item indices in ascending order or ``None``
+            for all items
+
+        """
+        if match_on & ~SUBSTRING_RULES:
+            return None
+
+        ngrams = set()
+        for word, view in words:
+            if view is self._folded:
+                ngrams.update(_ngrams(word))
+
+        if not ngrams:
+            return None
+
+        postings = []
+        for ngram in ngrams:
+            n = bisect_left(self._ngrams, ngram)
+            if n == len(self._ngrams) or self._ngrams[n] != ngram:
+                return []
+            postings.append(
+                self._postings[self._offsets[n]:self._offsets[n + 1]])
+
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+
+        return sorted(candidates)
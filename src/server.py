@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Query server for the `brew` and `cask` script filters.
+
+Starting Python and importing the workflow for every keystroke takes longer
+than answering the query. The server does that once and then answers the
+queries `client.py` sends over a Unix domain socket, one at a time, keeping
+all cached lists, search corpora and catalogues it has loaded in memory
+(see `AppWorkflow.cache_memo`). Settings are read for every query, so changes
+apply immediately.
+
+`client.py` starts the server on demand; it exits after `IDLE_TIMEOUT`
+seconds without queries.
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+
+import brew
+import cask
+import client
+from appworkflow import AppWorkflow
+
+#: Seconds without queries after which the server exits
+IDLE_TIMEOUT = 300
+
+#: Seconds to wait for a client to send its query
+REQUEST_TIMEOUT = 5
+
+SCRIPTS = {
+    'brew': brew,
+    'cask': cask,
+}
+
+
+def handle(request, memo):
+    """
+    Run the script filter of `request` like Alfred would, with its arguments and
+    environment. Returns the feedback and the exit status.
+    """
+    module = SCRIPTS[request['script']]
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = ['%s.py' % request['script']] + request['args']
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        wf = module.create_workflow()
+        wf.cache_memo = memo
+        module.wf = wf
+        try:
+            status = wf.run(module.main)
+        except SystemExit as err:
+            # magic arguments exit after sending their feedback
+            status = err.code or 0
+    return {'output': output.getvalue(), 'status': status}
+
+
+def serve(wf, path, idle_timeout=IDLE_TIMEOUT):
+    """
+    Answer queries on the socket at `path` until none came for `idle_timeout` seconds.
+    Other users can't connect, as the directory of the socket must be private.
+    """
+    dirpath = os.path.dirname(path)
+    os.makedirs(dirpath, mode=0o700, exist_ok=True)
+    if not client.is_private(dirpath):
+        wf.logger.error('[server] %s is accessible to other users, not listening', dirpath)
+        return
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # left behind by a server that didn't exit cleanly
+    if os.path.exists(path):
+        os.unlink(path)
+    listener.bind(path)
+    listener.listen(8)
+    listener.settimeout(idle_timeout)
+    wf.logger.info('[server] listening on %s', path)
+
+    memo = {}
+    env = dict(os.environ)
+    try:
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                wf.logger.info('[server] idle for %ds, exiting', idle_timeout)
+                break
+            with conn:
+                try:
+                    conn.settimeout(REQUEST_TIMEOUT)
+                    request = json.loads(client.recv_all(conn).decode('utf-8'))
+                    response = handle(request, memo)
+                    conn.sendall(json.dumps(response).encode('utf-8'))
+                except Exception as err:
+                    # the client runs the script filter itself
+                    wf.logger.exception('[server] failed to answer query: %s', err)
+                finally:
+                    os.environ.clear()
+                    os.environ.update(env)
+    finally:
+        listener.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def main(wf):
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    serve(wf, client.socket_path())
+
+
+if __name__ == '__main__':
+    wf = AppWorkflow()
+    sys.exit(wf.run(main))
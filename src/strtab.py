@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Memory-mapped string table cache serializer, registered as `strtab`.
+
+The cached lists of formulae and casks are long lists of short strings,
+of which a script filter usually shows only a few. `StringTableSerializer`
+saves them so that loading such a list doesn't create all its strings.
+"""
+
+import mmap
+from array import array
+from collections.abc import Sequence
+
+from workflow.workflow import PickleSerializer, manager
+
+__all__ = ['StringTable', 'StringTableSerializer']
+
+
+class StringTable(Sequence):
+    """Read-only list of strings backed by a memory-mapped file.
+
+    Returned by :class:`StringTableSerializer`. Strings are only decoded
+    when they are accessed, so slicing the first few entries of a long list
+    or getting its length is cheap, whatever the size of the list.
+
+    Pickling a :class:`StringTable` results in a ``list``.
+
+    :param buf: serialized string table
+    :type buf: ``mmap.mmap`` or ``bytes``
+
+    """
+
+    def __init__(self, buf):
+        """Create new StringTable from ``buf``."""
+        header = StringTableSerializer.header_size
+        count = memoryview(buf)[4:header].cast('I')[0]
+        self._buf = buf
+        self._count = count
+        self._offsets = memoryview(buf)[header:header + 4 * (count + 1)].cast('I')
+        self._start = header + 4 * (count + 1)
+
+    def __len__(self):
+        """Number of strings in the table."""
+        return self._count
+
+    def __getitem__(self, index):
+        """Return string or ``list`` of strings at ``index``."""
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(self._count))]
+
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('string table index out of range')
+
+        return self._get(index)
+
+    def __iter__(self):
+        """Iterate over all strings in the table."""
+        for i in range(self._count):
+            yield self._get(i)
+
+    def __eq__(self, other):
+        """Compare equal to sequences containing the same strings."""
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        """Pickle as ``list``."""
+        return (list, (list(self),))
+
+    def __repr__(self):
+        """Format as ``StringTable([...])``."""
+        return 'StringTable(%r)' % list(self)
+
+    def _get(self, i):
+        start = self._start + self._offsets[i]
+        end = self._start + self._offsets[i + 1]
+        return str(self._buf[start:end], 'utf-8')
+
+
+class StringTableSerializer(object):
+    """Memory-mapped string tables for lists of strings, pickle otherwise.
+
+    Loading a pickled list of thousands of strings creates every string
+    up front. This serializer instead writes lists and tuples of strings
+    as a table of offsets followed by a single UTF-8 blob and loads them
+    as a :class:`StringTable` backed by :mod:`mmap`, which only decodes
+    the entries that are actually accessed.
+
+    All other objects are pickled, so this serializer can be used as
+    :attr:`Workflow.cache_serializer` for any cached data. It is
+    registered as ``strtab``.
+
+    Offsets are stored in native byte order, so files are not portable
+    between machines of different endianness.
+
+    """
+
+    #: Marks string tables, which can't be confused with pickles
+    magic = b'WFST'
+
+    #: Size of the magic bytes and the number of strings
+    header_size = 8
+
+    @classmethod
+    def load(cls, file_obj):
+        """Load string table or pickled object from open file.
+
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+        :returns: :class:`StringTable` or object loaded from pickle file
+        :rtype: object
+
+        """
+        if file_obj.read(len(cls.magic)) != cls.magic:
+            file_obj.seek(0)
+            return PickleSerializer.load(file_obj)
+
+        try:
+            buf = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            # not a real file
+            file_obj.seek(0)
+            buf = file_obj.read()
+
+        return StringTable(buf)
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        """Serialize object ``obj`` to open file.
+
+        :param obj: Python object to serialize. Lists and tuples of
+            strings are written as string table, which load as
+            :class:`StringTable`.
+        :type obj: Python object
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+
+        """
+        if (not isinstance(obj, (list, tuple, StringTable)) or
+                not all(isinstance(s, str) for s in obj)):
+            return PickleSerializer.dump(obj, file_obj)
+
+        encoded = [s.encode('utf-8') for s in obj]
+        offsets = array('I', [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+
+        file_obj.write(cls.magic)
+        file_obj.write(array('I', [len(encoded)]).tobytes())
+        file_obj.write(offsets.tobytes())
+        file_obj.write(b''.join(encoded))
+
+
+manager.register('strtab', StringTableSerializer)
@@ -1,20 +1,512 @@
 #!/usr/bin/env python3
 # encoding: utf-8
 
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
 import unittest
+from unittest import mock
 
 import brew
 import cask
+import catalogue
+import cellar
+import client
 import helpers
-from workflow import Workflow
+import inventory
+import refresh
+import server
+from appworkflow import CACHE_MEMO_SIZE, CACHE_STORES, UPDATE_STATUS_KEY, AppWorkflow
+from jobs import run_in_background
+from search import Corpus, subsequence_end
+from tracer import CommandTracer, percentile
+from workflow import MATCH_ALL, MATCH_SUBSTRING, Workflow
+from workflow import background
 
 
 class HomeBrewTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.wf = Workflow()
-        cask.wf = Workflow()
-        brew.wf = Workflow()
+        # keep the cache and data of the user's workflow out of the tests
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.cachedir = os.path.join(tempdir, 'cache')
+        for patcher in (mock.patch.dict(os.environ, {'alfred_workflow_cache': self.cachedir,
+                                                     'alfred_workflow_data': os.path.join(tempdir, 'data')}),
+                        # background jobs keep their PID files in the cache directory
+                        mock.patch.object(background, '_wf', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.wf = AppWorkflow()
+        cask.wf = AppWorkflow()
+        brew.wf = AppWorkflow()
+
+    def write_api_cache(self):
+        """ Fake Homebrew API cache with a signed formula and a plain cask file. """
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        os.mkdir(os.path.join(cache_dir, 'api'))
+        formulae = [
+            {'name': 'wget', 'desc': 'Internet file retriever', 'revision': 0,
+             'version_scheme': 0, 'versions': {'stable': '1.21.4'}},
+            {'name': 'gettext', 'desc': 'GNU tools', 'revision': 1,
+             'version_scheme': 0, 'versions': {'stable': '0.22'}},
+        ]
+        casks = [{'token': 'firefox', 'version': '120.0', 'desc': 'Web browser',
+                  'auto_updates': True}]
+        with open(os.path.join(cache_dir, 'api', 'formula.jws.json'), 'w') as fp:
+            json.dump({'payload': json.dumps(formulae), 'signatures': []}, fp)
+        with open(os.path.join(cache_dir, 'api', 'cask.json'), 'w') as fp:
+            json.dump(casks, fp)
+        os.environ['HOMEBREW_CACHE'] = cache_dir
+        return cache_dir
+
+    def test_get_catalogue(self):
+        self.write_api_cache()
+        formulae = catalogue.get_catalogue(self.wf, 'formula')
+        self.assertEqual(formulae['names'], ['gettext', 'wget'])
+        self.assertEqual(formulae['metadata']['gettext']['revision'], 1)
+        self.assertEqual(brew.get_all_formulae(), ['gettext', 'wget'])
+        self.assertEqual(cask.get_all_casks(), ['firefox'])
+        self.assertEqual(catalogue.get_catalogue(self.wf, 'formula'), formulae)
+
+    def make_prefix(self):
+        """ Fake Homebrew prefix with two formulae (one pinned) and a cask. """
+        prefix = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, prefix)
+        for path in ['Cellar/wget/1.21.4', 'Cellar/wget/1.9', 'Cellar/gettext/0.21_1',
+                     'Cellar/.keepme', 'Caskroom/firefox/119.0', 'Caskroom/firefox/.metadata',
+                     'var/homebrew/pinned']:
+            os.makedirs(os.path.join(prefix, path))
+        os.symlink('../../../Cellar/gettext/0.21_1',
+                   os.path.join(prefix, 'var/homebrew/pinned/gettext'))
+        return prefix
+
+    def test_cellar(self):
+        prefix = self.make_prefix()
+        self.assertEqual(cellar.installed_formulae(prefix), ['gettext 0.21_1', 'wget 1.9 1.21.4'])
+        self.assertEqual(cellar.pinned_formulae(prefix), ['gettext 0.21_1'])
+        self.assertEqual(cellar.installed_casks(prefix), ['firefox'])
+        self.assertIsNone(cellar.installed_formulae(os.path.join(prefix, 'missing')))
+
+    def test_outdated(self):
+        self.write_api_cache()
+        prefix = self.make_prefix()
+        formulae = catalogue.get_catalogue(self.wf, 'formula')['metadata']
+        self.assertEqual(cellar.outdated_formulae(prefix, formulae),
+                         ['gettext (0.21_1) < 0.22_1 [pinned at 0.21_1]'])
+        casks = catalogue.get_catalogue(self.wf, 'cask')['metadata']
+        self.assertEqual(cellar.outdated_casks(prefix, casks), [])
+        casks['firefox']['auto_updates'] = False
+        self.assertEqual(cellar.outdated_casks(prefix, casks), ['firefox (119.0) != 120.0'])
+        # only `brew` knows whether kegs of formulae and casks from other taps are outdated
+        os.makedirs(os.path.join(prefix, 'Cellar/tapped/1.0'))
+        os.makedirs(os.path.join(prefix, 'Caskroom/tapped/1.0'))
+        self.assertIsNone(cellar.outdated_formulae(prefix, formulae))
+        self.assertIsNone(cellar.outdated_casks(prefix, casks))
+
+    def test_tap_names(self):
+        self.write_api_cache()
+        prefix = self.make_prefix()
+        os.environ['HOMEBREW_PREFIX'] = prefix
+        taps = os.path.join(prefix, 'Library/Taps')
+        for path in ['user/homebrew-repo/Formula/foo.rb', 'user/homebrew-repo/Formula/b/bar.rb',
+                     'user/homebrew-repo/Casks/baz.rb', 'user/homebrew-repo/README.md',
+                     'user/other/qux.rb', 'homebrew/homebrew-core/Formula/wget.rb']:
+            os.makedirs(os.path.dirname(os.path.join(taps, path)), exist_ok=True)
+            open(os.path.join(taps, path), 'w').close()
+        self.assertEqual(cellar.tap_names(prefix, 'formula'),
+                         ['user/other/qux', 'user/repo/bar', 'user/repo/foo'])
+        self.assertEqual(brew.get_all_formulae(), ['gettext', 'user/other/qux', 'user/repo/bar',
+                                                   'user/repo/foo', 'wget'])
+        self.assertEqual(cask.get_all_casks(), ['firefox', 'user/repo/baz'])
+
+    def test_validators(self):
+        self.write_api_cache()
+        prefix = self.make_prefix()
+        os.environ['HOMEBREW_PREFIX'] = prefix
+        validator = helpers.get_validator(self.wf, 'brew_installed_formulae')
+        self.assertIsNotNone(validator)
+        old = time.time() - 2 * helpers.CACHE_MAX_AGE
+        helpers.cache_list(self.wf, 'brew_installed_formulae', ['wget 1.21.4'], validator)
+        os.utime(self.wf.cachefile('brew_installed_formulae.pickle'), (old, old))
+        status = refresh.update_status(self.wf, old, {'brew_installed_formulae': 0.1})
+        status['keys']['brew_installed_formulae']['updated'] = old
+        # old, but nothing changed
+        self.assertNotIn('brew_installed_formulae', helpers.due_lists(self.wf, status))
+        self.assertEqual(self.wf.cached_data('brew_installed_formulae', max_age=60,
+                                             validator=validator), ['wget 1.21.4'])
+        # a new keg changes the rack's mtime
+        os.utime(os.path.join(prefix, 'Cellar/wget'), (old, old))
+        os.makedirs(os.path.join(prefix, 'Cellar/wget/1.22'))
+        validator = helpers.get_validator(self.wf, 'brew_installed_formulae')
+        self.assertIn('brew_installed_formulae', helpers.due_lists(self.wf, status))
+        self.assertIsNone(self.wf.cached_data('brew_installed_formulae', max_age=0,
+                                              validator=validator))
+        self.assertIsNone(helpers.get_validator(self.wf, 'test_unknown_list'))
+
+    def test_string_table(self):
+        wf = AppWorkflow()
+        wf.cache_serializer = 'strtab'
+        wf.cache_data('test_strtab', ['wget', 'gettext', u'\u00e9t\u00e9', ''])
+        names = wf.cached_data('test_strtab', max_age=0)
+        self.assertEqual(len(names), 4)
+        self.assertEqual(names[2], u'\u00e9t\u00e9')
+        self.assertEqual(names[-3:-1], ['gettext', u'\u00e9t\u00e9'])
+        self.assertEqual(wf.filter('gett', names, match_on=MATCH_SUBSTRING), ['gettext'])
+        self.assertEqual(len(Corpus(names)), 4)
+        wf.cache_data('test_strtab_status', {'last_run': 1})
+        self.assertEqual(wf.cached_data('test_strtab_status', max_age=0), {'last_run': 1})
+
+    def test_sqlite_cache_store(self):
+        wf = AppWorkflow()
+        wf.cache_store = 'sqlite'
+        helpers.cache_list(wf, 'test_sqlite_list', ['wget', 'gettext'], validator=(1, 2))
+        self.assertEqual(wf.cached_data('test_sqlite_list', max_age=60), ['wget', 'gettext'])
+        self.assertEqual(len(wf.cached_data('test_sqlite_list_corpus', max_age=60)), 2)
+        self.assertTrue(wf.cached_data_valid('test_sqlite_list', (1, 2)))
+        self.assertIsNone(wf.cached_data('test_sqlite_list', max_age=60, validator=(1, 3)))
+        self.assertLess(wf.cached_data_age('test_sqlite_list'), 60)
+        self.assertEqual(wf.cached_data_age('test_sqlite_missing'), 0)
+        with self.assertRaises(RuntimeError):
+            with wf.cache_transaction():
+                helpers.cache_list(wf, 'test_sqlite_list', ['wget'])
+                raise RuntimeError('refresh failed')
+        self.assertEqual(wf.cached_data('test_sqlite_list', max_age=0), ['wget', 'gettext'])
+        self.assertEqual(len(wf.cached_data('test_sqlite_list_corpus', max_age=0)), 2)
+        helpers.cache_list(wf, 'test_sqlite_list', None)
+        self.assertIsNone(wf.cached_data('test_sqlite_list', max_age=0))
+
+    def test_info_metadata(self):
+        metadata = AppWorkflow().info_metadata
+        self.assertEqual(metadata['bundleid'], 'com.fniephaus.homebrew')
+        self.assertTrue(os.path.exists(os.path.join(self.cachedir, '__workflow_info.json')))
+        wf = AppWorkflow()
+        wf._load_info_plist = None  # must not be called
+        self.assertEqual(wf.info_metadata, metadata)
+        self.assertEqual(wf.bundleid, 'com.fniephaus.homebrew')
+        self.assertFalse(wf.update_available)
+
+    def test_run_in_background(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'done')
+        self.assertEqual(run_in_background(
+            'test_background', ['/bin/sh', '-c', 'sleep 0.2; touch done'], cwd=tempdir), 0)
+        self.assertTrue(background.is_running('test_background'))
+        self.assertIsNone(run_in_background('test_background', ['/bin/true']))
+        for _ in range(100):
+            if not background.is_running('test_background'):
+                break
+            time.sleep(0.05)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(background.kill('test_background'))
+
+    def test_run_in_background_closes_fds(self):
+        client_sock, server_sock = socket.socketpair()
+        self.addCleanup(client_sock.close)
+        run_in_background('test_background_fds', ['/bin/sleep', '2'])
+        self.addCleanup(background.kill, 'test_background_fds')
+        # the job must not keep the socket open
+        server_sock.close()
+        client_sock.settimeout(1)
+        self.assertEqual(client_sock.recv(1), b'')
+
+    def test_spans(self):
+        os.environ['alfred_debug'] = '1'
+        wf = AppWorkflow()
+
+        def main(wf):
+            with wf.span('filter'):
+                wf.add_item('wget')
+            wf.send_feedback()
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(wf.run(main), 0)
+        names = [name for name, _ in wf.spans]
+        self.assertEqual(names[names.index('filter'):][:3], ['filter', 'items', 'feedback'])
+        self.assertEqual(json.loads(output.getvalue())['items'][-1]['title'], 'Timings')
+        with open(wf.cachefile('__workflow_metrics.jsonl')) as fp:
+            metrics = json.loads(fp.readlines()[-1])
+        self.assertEqual([name for name, _ in metrics['spans']], names)
+
+        # only saved while debugging or if enabled
+        os.environ.pop('alfred_debug')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(AppWorkflow().run(main), 0)
+        with open(wf.cachefile('__workflow_metrics.jsonl')) as fp:
+            self.assertEqual(json.loads(fp.readlines()[-1]), metrics)
+
+    def test_execute_ignores_warnings(self):
+        bindir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bindir)
+        with open(os.path.join(bindir, 'brew'), 'w') as fp:
+            fp.write('#!/bin/sh\necho "Warning: deprecated" >&2\n'
+                     '[ "$1" = fail ] && exit 1\necho wget\n')
+        os.chmod(os.path.join(bindir, 'brew'), 0o755)
+        self.addCleanup(os.environ.__setitem__, 'PATH', os.environ['PATH'])
+        os.environ['PATH'] = '%s:%s' % (bindir, os.environ['PATH'])
+        self.assertEqual(brew.execute(brew.wf, ['brew', 'list']), 'wget\n')
+        self.assertEqual(brew.execute(brew.wf, ['brew', 'fail']), 'Error: Warning: deprecated\n')
+
+    def test_command_tracer(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        tracer = CommandTracer(os.path.join(tempdir, 'commands.json'))
+        with tracer.cache_key('brew_all_formulae'):
+            result = tracer.run(['echo', 'wget'])
+        self.assertEqual(result.stdout, b'wget\n')
+        self.assertEqual(tracer.run(['false']).returncode, 1)
+        calls = tracer.load()['calls']
+        self.assertEqual([call['cache_key'] for call in calls], ['brew_all_formulae', None])
+        self.assertEqual([call['stdout_bytes'] for call in calls], [5, 0])
+        stats = {command['name']: command for command in tracer.stats()}
+        self.assertEqual(stats['false']['failures'], 1)
+        self.assertEqual(stats['echo wget']['count'], 1)
+        self.assertEqual(percentile([0, 1, 0, 8, 1] + [0] * 7, 50), 100)
+        self.assertEqual(percentile([0, 1, 0, 8, 1] + [0] * 7, 95), 250)
+
+    def test_profile(self):
+        self.addCleanup(setattr, sys, 'argv', sys.argv)
+        queries = []
+
+        def main(wf):
+            queries.append(wf.args[0])
+            Corpus(['wget', 'gettext'] * 100)
+
+        sys.argv = ['brew.py', 'install wget workflow:profilemem']
+        self.assertEqual(AppWorkflow().run(main), 0)
+        self.assertEqual(queries, ['install wget'])
+        profiles = os.path.join(self.cachedir, '__workflow_profiles')
+        reports = [name for name in os.listdir(profiles) if name.endswith('.txt')]
+        self.assertEqual(len(reports), 1)
+        with open(os.path.join(profiles, reports[0])) as fp:
+            report = fp.read()
+        self.assertIn('function calls', report)
+        self.assertIn('allocations', report)
+        self.assertEqual(len(os.listdir(profiles)), 2)
+
+        # only a last word that is a magic argument turns profiling on
+        for query in ('install workflow:profile wget', 'install workflow:profilex'):
+            sys.argv = ['brew.py', query]
+            self.assertEqual(AppWorkflow().run(main), 0)
+            self.assertEqual(queries[-1], query)
+        self.assertEqual(len(os.listdir(profiles)), 2)
+
+        # an error saving the profile doesn't replace the one of the run
+        def fail(wf):
+            raise ValueError('run failed')
+
+        wf = AppWorkflow()
+        with mock.patch.object(wf, '_save_profile', side_effect=OSError('disk full')):
+            with self.assertRaisesRegex(ValueError, 'run failed'):
+                wf._run_profiled(fail)
+
+    def test_setup_cache_unknown_store(self):
+        wf = types.SimpleNamespace(settings={'HOMEBREW_OPTS': {'cache_store': 'sqlit'}},
+                                   logger=self.wf.logger)
+        helpers.setup_cache(wf)
+        self.assertEqual(wf.cache_store, helpers.CACHE_STORE)
+
+    def test_fresh_update_status_starts_no_check(self):
+        # update.py saves the status with the library's default serializer
+        Workflow().cache_data(UPDATE_STATUS_KEY, {'available': {'version': '9.0'}})
+        for store in CACHE_STORES:
+            AppWorkflow().settings['HOMEBREW_OPTS'] = {'cache_store': store}
+            wf = brew.create_workflow()
+            self.assertEqual(wf.cache_serializer, helpers.CACHE_SERIALIZER)
+            with mock.patch.object(background, 'run_in_background') as run:
+                wf.check_update()
+            run.assert_not_called()
+            self.assertEqual(wf.update_available, {'version': '9.0'})
+
+        os.unlink(wf.cachefile(UPDATE_STATUS_KEY + '.pickle'))
+        with mock.patch.object(background, 'run_in_background') as run:
+            wf.check_update()
+        self.assertEqual(run.call_args[0][0], '__workflow_update_check')
+
+    def test_query_server(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.addCleanup(setattr, sys, 'argv', sys.argv)
+        self.addCleanup(server.SCRIPTS.pop, 'test')
+        path = os.path.join(tempdir, 'server.sock')
+
+        def main(wf):
+            wf.add_item('query: %s' % wf.args[0])
+            wf.send_feedback()
+
+        def query():
+            # the socket exists a moment before the server listens on it
+            for _ in range(200):
+                response = client.query('test', ['wget'], path)
+                if response is not None:
+                    break
+                time.sleep(0.01)
+            responses.append(response)
+
+        server.SCRIPTS['test'] = types.SimpleNamespace(create_workflow=AppWorkflow, main=main)
+        responses = []
+        thread = threading.Thread(target=query)
+        thread.start()
+        # the server must run in the main thread, which handles signals
+        server.serve(self.wf, path, idle_timeout=1)
+        thread.join()
+        self.assertEqual(responses[0]['status'], 0)
+        self.assertEqual(json.loads(responses[0]['output'])['items'][0]['title'], 'query: wget')
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(client.query('test', ['wget'], path))
+        os.chmod(tempdir, 0o755)
+        self.assertFalse(client.is_private(tempdir))
+        self.assertIsNone(client.query('test', ['wget'], path))
+        server.serve(self.wf, path, idle_timeout=1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_cache_memo(self):
+        wf = AppWorkflow()
+        wf.cache_memo = {}
+        loads = []
+
+        def load(name):
+            return wf._load_memo(name, 1, lambda: loads.append(name) or name)
+
+        for i in range(CACHE_MEMO_SIZE + 1):
+            load('test_memo_%d' % i)
+        self.assertEqual(len(wf.cache_memo), CACHE_MEMO_SIZE)
+        self.assertNotIn('test_memo_0', wf.cache_memo)
+        load('test_memo_1')
+        self.assertEqual(list(wf.cache_memo)[-1], 'test_memo_1')
+        self.assertEqual(len(loads), CACHE_MEMO_SIZE + 1)
+
+    def test_refresh_run(self):
+        def fail():
+            raise RuntimeError('brew failed')
+
+        timings = refresh.run(self.wf, {
+            'test_refresh_list': lambda: ['a', 'b'],
+            ('test_refresh_other',): lambda: {'test_refresh_other': ['c']},
+            'test_refresh_failed': fail,
+        })
+        self.assertEqual(set(timings), {'test_refresh_list', 'test_refresh_other',
+                                        'test_refresh_failed'})
+        self.assertIsNone(timings['test_refresh_failed'])
+        self.assertEqual(self.wf.cached_data('test_refresh_list', max_age=0), ['a', 'b'])
+        self.assertEqual(len(self.wf.cached_data('test_refresh_list_corpus', max_age=0)), 2)
+        self.assertEqual(self.wf.cached_data('test_refresh_other', max_age=0), ['c'])
+
+    def test_refresh_builds_corpora_before_locking(self):
+        wf = AppWorkflow()
+        wf.cache_store = 'sqlite'
+        locked = []
+
+        def corpus(data):
+            locked.append(wf.cache_db.connection.in_transaction)
+            return Corpus(data)
+
+        with mock.patch.object(helpers, 'Corpus', side_effect=corpus):
+            refresh.run(wf, {('test_refresh_list', 'test_refresh_other'):
+                             lambda: {'test_refresh_list': ['a'], 'test_refresh_other': ['b']}})
+        self.assertEqual(locked, [False, False])
+        self.assertEqual(wf.cached_data('test_refresh_other', max_age=0), ['b'])
+
+    def test_refresh_due(self):
+        self.assertTrue(helpers.refresh_due(self.wf))
+        now = time.time()
+        status = refresh.update_status(self.wf, now, {key: 0.1 for key in helpers.REFRESH_MAX_AGES})
+        self.assertFalse(helpers.refresh_due(self.wf))
+        status['last_run'] = now - 2 * helpers.REFRESH_INTERVAL
+        self.wf.cache_data(helpers.REFRESH_STATUS_KEY, status)
+        self.assertFalse(helpers.refresh_due(self.wf))
+        status['keys']['brew_outdated_formulae']['updated'] = now - 2 * helpers.REFRESH_INTERVAL
+        self.wf.cache_data(helpers.REFRESH_STATUS_KEY, status)
+        self.assertTrue(helpers.refresh_due(self.wf))
+
+    def test_get_cached_after_failed_refresh(self):
+        name = 'test_failed_list'
+        helpers.cache_list(self.wf, name, ['a'])
+        old = time.time() - 2 * helpers.CACHE_MAX_AGE
+        os.utime(self.wf.cachefile(name + '.pickle'), (old, old))
+        status = refresh.update_status(self.wf, time.time(), {name: None})
+        self.assertIn(name, status['failed'])
+        # stale, but no refresh is started and Alfred isn't asked to re-run
+        self.assertEqual(helpers.get_cached(self.wf, name, lambda: ['b']), ['a'])
+        self.assertFalse(self.wf.rerun)
+        status = refresh.update_status(self.wf, time.time(), {name: 0.1})
+        self.assertNotIn(name, status['failed'])
+
+    def test_cached_data_or_stale(self):
+        name = 'test_stale'
+        refreshed = []
+        data, stale = self.wf.cached_data_or_stale(name, lambda: ['a'], max_age=60,
+                                                   refresh=lambda: refreshed.append(1))
+        self.assertEqual((data, stale, refreshed), (['a'], False, []))
+        old = time.time() - 120
+        os.utime(self.wf.cachefile(name + '.pickle'), (old, old))
+        data, stale = self.wf.cached_data_or_stale(name, lambda: ['b'], max_age=60,
+                                                   refresh=lambda: refreshed.append(1))
+        self.assertEqual((data, stale, refreshed), (['a'], True, [1]))
+
+    def test_refresh_jobs(self):
+        jobs = refresh.get_jobs(self.wf, ['brew_all_formulae', 'brew_pinned_formulae'])
+        self.assertIn('brew_all_formulae', jobs)
+        self.assertNotIn('cask_all_casks', jobs)
+        self.assertTrue(any('brew_pinned_formulae' in (job if isinstance(job, tuple) else [job])
+                            for job in jobs))
+
+    def test_refresh_jobs_due(self):
+        now = time.time()
+        status = refresh.update_status(self.wf, now, {key: 0.1 for key in helpers.REFRESH_MAX_AGES})
+        self.assertEqual(refresh.get_jobs(self.wf), {})
+        # older than the refresh interval, but not than their own maximum age
+        for key in helpers.REFRESH_MAX_AGES:
+            status['keys'][key]['updated'] = now - 2 * helpers.REFRESH_INTERVAL
+        self.wf.cache_data(helpers.REFRESH_STATUS_KEY, status)
+        jobs = refresh.get_jobs(self.wf)
+        self.assertNotIn('brew_all_formulae', jobs)
+        self.assertNotIn('cask_all_casks', jobs)
+        self.assertEqual({key for job in jobs for key in refresh.job_keys(job)},
+                         {key for key, max_age in helpers.REFRESH_MAX_AGES.items() if not max_age})
+
+    def test_refresh_parses_catalogues_once(self):
+        self.write_api_cache()
+        os.environ['HOMEBREW_PREFIX'] = self.make_prefix()
+        keys = ['brew_all_formulae', 'brew_outdated_formulae', 'cask_all_casks', 'cask_outdated_casks']
+        with mock.patch.object(catalogue, 'load', wraps=catalogue.load) as load:
+            timings = refresh.run(self.wf, refresh.get_jobs(self.wf, keys))
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(sorted(timings), sorted(keys))
+        self.assertNotIn(None, timings.values())
+        self.assertEqual(self.wf.cached_data('brew_outdated_formulae', max_age=0),
+                         ['gettext (0.21_1) < 0.22_1 [pinned at 0.21_1]'])
+
+    def test_parse_inventory(self):
+        lists = inventory.parse_inventory({
+            'formulae': [
+                {'name': 'wget', 'installed': [{'version': '1.21.3'}], 'pinned': False,
+                 'outdated': True, 'versions': {'stable': '1.21.4'}, 'revision': 0},
+                {'name': 'gettext', 'installed': [{'version': '0.22_1'}], 'pinned': True,
+                 'linked_keg': '0.22_1', 'outdated': False},
+            ],
+            'casks': [{'token': 'firefox', 'installed': '119.0', 'version': '120.0',
+                       'outdated': True}],
+        })
+        self.assertEqual(lists, {
+            'brew_installed_formulae': ['gettext 0.22_1', 'wget 1.21.3'],
+            'brew_pinned_formulae': ['gettext 0.22_1'],
+            'brew_outdated_formulae': ['wget (1.21.3) < 1.21.4'],
+            'cask_installed_casks': ['firefox'],
+            'cask_outdated_casks': ['firefox (119.0) != 120.0'],
+        })
 
     def test_get_all_formulae(self):
         result = brew.get_all_formulae()
@@ -54,6 +546,45 @@ class HomeBrewTestCase(unittest.TestCase):
             result = brew.execute(brew.wf, ['brew', cmd])
             self.assertTrue(len(result) > 0)
 
+    def test_filter_corpus(self):
+        items = ['python@3.11', 'Pyenv', 'ipython', 'mypy', 'Zürich-tool',
+                 'node', 'go-task', '', 'GoogleChrome']
+        corpus = Corpus(items)
+        for match_on in (MATCH_SUBSTRING, MATCH_ALL):
+            for query in ['py', 'PY thon', 'zur', 'zür', 'gc', 'gt', 'x', '  ',
+                          'pyth', 'chrome', 'tool zur', 'go-t', 'xyz']:
+                self.assertEqual(
+                    self.wf.filter_corpus(query, corpus, match_on=match_on,
+                                          include_score=True),
+                    self.wf.filter(query, items, match_on=match_on,
+                                   include_score=True))
+
+    def test_filter_corpus_narrow(self):
+        items = ['python', 'pyenv', 'ipython', 'node']
+        corpus = Corpus(items)
+        for query in ['p', 'py', 'pyt', 'pyth', 'py e', 'n']:
+            self.assertEqual(
+                self.wf.filter_corpus(query, corpus, match_on=MATCH_SUBSTRING,
+                                      narrow='test_matches'),
+                self.wf.filter(query, items, match_on=MATCH_SUBSTRING))
+
+    def test_subsequence_end(self):
+        for text in ['python@3.11', 'google-chrome', 'aaab', '']:
+            for query in ['p3', 'gc', 'chr', 'ab', 'ba', 'x']:
+                match = re.search(''.join('.*?%s' % re.escape(c) for c in query), text)
+                self.assertEqual(subsequence_end(text, query), match.end() if match else 0)
+
+    def test_filter_max_results(self):
+        items = ['a%d' % i for i in range(50)] + ['b', 'ab', 'ba']
+        for ascending in (False, True):
+            for min_score in (0, 90):
+                results = self.wf.filter('a', items, ascending=ascending,
+                                         min_score=min_score)
+                self.assertEqual(
+                    self.wf.filter_corpus('a', Corpus(items), ascending=ascending,
+                                          min_score=min_score, max_results=5),
+                    results[:5])
+
 
 if __name__ == "__main__":
     unittest.main()
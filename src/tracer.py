@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""
+Record how long the commands the workflow runs take.
+
+A `CommandTracer` runs commands and records the duration, exit status
+and output size of every call. Durations are aggregated into a latency
+histogram per command, e.g. `brew outdated`, which is saved in a JSON
+file, so percentiles can be shown across many runs (see the
+`workflow:stats` magic argument of `AppWorkflow`).
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from workflow.util import LockFile, atomic_writer
+
+__all__ = ['CommandTracer', 'command_name', 'percentile']
+
+#: Upper bounds of the histogram buckets in milliseconds. A last bucket
+#: counts the calls that took longer.
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+#: Number of recent calls saved with the histograms
+MAX_CALLS = 50
+
+
+def command_name(cmd):
+    """Name of command ``cmd`` in the statistics.
+
+    The program and its first argument that isn't an option,
+    e.g. ``brew list`` for ``['brew', 'list', '--cask']``.
+
+    :param cmd: Command arguments
+    :type cmd: ``list``
+    :rtype: ``str``
+
+    """
+    name = [os.path.basename(str(cmd[0]))]
+    for arg in cmd[1:]:
+        arg = str(arg)
+        if not arg.startswith('-'):
+            name.append(arg)
+            break
+    return ' '.join(name)
+
+
+def percentile(buckets, q):
+    """Estimate percentile ``q`` of a histogram.
+
+    :param buckets: Number of calls per bucket of :data:`BUCKETS`
+    :type buckets: ``list``
+    :param q: Percentile between 0 and 100
+    :type q: ``float``
+    :returns: Upper bound of the bucket the percentile falls into in
+        milliseconds, ``None`` if there are no calls or if it falls
+        into the last bucket
+    :rtype: ``int``
+
+    """
+    total = sum(buckets)
+    if not total:
+        return None
+
+    rank = total * q / 100.0
+    count = 0
+    for bound, calls in zip(BUCKETS + (None,), buckets):
+        count += calls
+        if count >= rank:
+            return bound
+
+
+class CommandTracer(object):
+    """Latency histograms of the commands a workflow runs.
+
+    Calls are saved in the JSON file at ``path`` as soon as they are
+    recorded. Several threads and processes may record at the same time.
+
+    :param path: Path to the statistics file.
+    :type path: ``str``
+
+    """
+
+    def __init__(self, path):
+        """Create new CommandTracer saving to ``path``."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._lockfile = LockFile(path)
+        self._local = threading.local()
+
+    @contextmanager
+    def cache_key(self, name):
+        """Context manager to record cache key ``name`` with the calls
+        made within it in the current thread.
+
+        :param name: Cache key the commands fetch data for
+        :type name: ``str``
+
+        """
+        previous = getattr(self._local, 'cache_key', None)
+        self._local.cache_key = name
+        try:
+            yield
+        finally:
+            self._local.cache_key = previous
+
+    def run(self, cmd, **kwargs):
+        """Run ``cmd``, capturing its output, and record the call.
+
+        :param cmd: Command arguments to pass to :func:`subprocess.run`
+        :type cmd: ``list``
+        :param \\**kwargs: Keyword arguments to pass to
+            :func:`subprocess.run`
+        :returns: Exit status, output and error output (as ``bytes``)
+            of the command
+        :rtype: :class:`subprocess.CompletedProcess`
+
+        """
+        import subprocess
+
+        start = time.time()
+        result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, **kwargs)
+        self.record(cmd, time.time() - start, result.returncode,
+                    len(result.stdout), len(result.stderr))
+        return result
+
+    def record(self, cmd, duration, status, stdout_bytes, stderr_bytes=None):
+        """Add a call of ``cmd`` to the statistics.
+
+        :param cmd: Command arguments
+        :type cmd: ``list``
+        :param duration: Duration of the call in seconds
+        :type duration: ``float``
+        :param status: Exit status
+        :type status: ``int``
+        :param stdout_bytes: Size of the output
+        :type stdout_bytes: ``int``
+        :param stderr_bytes: Size of the error output (``None`` if it
+            wasn't captured)
+        :type stderr_bytes: ``int``
+
+        """
+        milliseconds = duration * 1000
+        name = command_name(cmd)
+        call = {
+            'command': [str(arg) for arg in cmd],
+            'time': time.time(),
+            'duration': round(milliseconds, 3),
+            'status': status,
+            'stdout_bytes': stdout_bytes,
+            'stderr_bytes': stderr_bytes,
+            'cache_key': getattr(self._local, 'cache_key', None),
+        }
+        bucket = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if milliseconds <= bound:
+                bucket = i
+                break
+
+        with self._lock, self._lockfile:
+            data = self.load()
+            stats = data['commands'].setdefault(name, {
+                'count': 0,
+                'failures': 0,
+                'stdout_bytes': 0,
+                'stderr_bytes': 0,
+                'buckets': [0] * (len(BUCKETS) + 1),
+            })
+            stats['count'] += 1
+            stats['failures'] += 1 if status else 0
+            stats['stdout_bytes'] += stdout_bytes
+            stats['stderr_bytes'] += stderr_bytes or 0
+            stats['buckets'][bucket] += 1
+            data['calls'] = (data['calls'] + [call])[-MAX_CALLS:]
+            with atomic_writer(self.path, 'w') as file_obj:
+                json.dump(data, file_obj)
+
+    def load(self):
+        """Return saved histograms and recent calls.
+
+        :returns: ``dict`` with the statistics of every command
+            (``commands``) and the last :data:`MAX_CALLS` calls
+            (``calls``)
+        :rtype: ``dict``
+
+        """
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as file_obj:
+                    return json.load(file_obj)
+            except ValueError:  # pragma: no cover
+                pass
+
+        return {'commands': {}, 'calls': []}
+
+    def stats(self):
+        """Return a summary of every command, slowest first.
+
+        :returns: ``dict`` per command with its ``name``, ``count``,
+            ``failures``, mean output size (``stdout_bytes``) and
+            estimated ``p50`` and ``p95`` latencies (see
+            :func:`percentile`)
+        :rtype: ``list``
+
+        """
+        summary = []
+        for name, stats in self.load()['commands'].items():
+            summary.append({
+                'name': name,
+                'count': stats['count'],
+                'failures': stats['failures'],
+                'stdout_bytes': stats['stdout_bytes'] // stats['count'],
+                'p50': percentile(stats['buckets'], 50),
+                'p95': percentile(stats['buckets'], 95),
+            })
+
+        def slowest(item):
+            return [BUCKETS[-1] + 1 if item[q] is None else item[q]
+                    for q in ('p95', 'p50')]
+
+        return sorted(summary, key=slowest, reverse=True)
@@ -18,7 +18,6 @@ import functools
 import json
 import os
 import signal
-import subprocess
 import sys
 import time
 from collections import namedtuple
@@ -154,6 +153,7 @@ def run_command(cmd, **kwargs):
 
     """
     cmd = [str(s) for s in cmd]
+    import subprocess
     return subprocess.check_output(cmd, **kwargs)
 
 
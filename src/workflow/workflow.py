@@ -28,17 +28,11 @@ up your Python script to best utilise the :class:`Workflow` object.
 
 """
 
-import binascii
 import json
 import logging
-import logging.handlers
 import os
-import pickle
-import plistlib
 import re
-import shutil
 import string
-import subprocess
 import sys
 import time
 import unicodedata
@@ -601,6 +595,7 @@ class PickleSerializer(object):
         :rtype: object
 
         """
+        import pickle
         return pickle.load(file_obj)
 
     @classmethod
@@ -615,6 +610,7 @@ class PickleSerializer(object):
         :type file_obj: ``file`` object
 
         """
+        import pickle
         return pickle.dump(obj, file_obj, protocol=-1)
 
 
@@ -1716,13 +1712,14 @@ class Workflow(object):
         # Exclude from coverage, as pytest will have configured the
         # root logger already
         if not len(logger.handlers):  # pragma: no cover
+            from logging.handlers import RotatingFileHandler
 
             fmt = logging.Formatter(
                 '%(asctime)s %(filename)s:%(lineno)s'
                 ' %(levelname)-8s %(message)s',
                 datefmt='%H:%M:%S')
 
-            logfile = logging.handlers.RotatingFileHandler(
+            logfile = RotatingFileHandler(
                 self.logfile,
                 maxBytes=1024 * 1024,
                 backupCount=1)
@@ -2873,6 +2870,7 @@ class Workflow(object):
             h = groups.get('hex')
             password = groups.get('pw')
             if h:
+                import binascii
                 password = str(binascii.unhexlify(h), 'utf-8')
 
         self.logger.debug('got password : %s:%s', service, account)
@@ -3056,26 +3054,32 @@ class Workflow(object):
 
     def open_log(self):
         """Open :attr:`logfile` in default app (usually Console.app)."""
+        import subprocess
         subprocess.call(['open', self.logfile])  # nosec
 
     def open_cachedir(self):
         """Open the workflow's :attr:`cachedir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.cachedir])  # nosec
 
     def open_datadir(self):
         """Open the workflow's :attr:`datadir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.datadir])  # nosec
 
     def open_workflowdir(self):
         """Open the workflow's :attr:`workflowdir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.workflowdir])  # nosec
 
     def open_terminal(self):
         """Open a Terminal window at workflow's :attr:`workflowdir`."""
+        import subprocess
         subprocess.call(['open', '-a', 'Terminal', self.workflowdir])  # nosec
 
     def open_help(self):
         """Open :attr:`help_url` in default browser."""
+        import subprocess
         subprocess.call(['open', self.help_url])  # nosec
 
         return 'Opening workflow help URL in browser'
@@ -3173,6 +3177,7 @@ class Workflow(object):
                     continue
                 path = os.path.join(dirpath, filename)
                 if os.path.isdir(path):
+                    import shutil
                     shutil.rmtree(path)
                 else:
                     os.unlink(path)
@@ -3181,6 +3186,7 @@ class Workflow(object):
     def _load_info_plist(self):
         """Load workflow info from ``info.plist``."""
         # info.plist should be in the directory above this one
+        import plistlib
         with open(self.workflowfile('info.plist'), 'rb') as fp:
             self._info = plistlib.load(fp)
         self._info_loaded = True
@@ -3222,6 +3228,7 @@ class Workflow(object):
         :rtype: `tuple` (`int`, ``str``)
 
         """
+        import subprocess
         cmd = ['security', action, '-s', service, '-a', account] + list(args)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                              stderr=subprocess.STDOUT)